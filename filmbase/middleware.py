@@ -0,0 +1,56 @@
+import logging
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('filmbase.queries')
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = ''
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if duration >= self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+
+class QueryStatsMiddleware:
+    # Считает SQL-запросы каждого запроса и их суммарное время, отдаёт
+    # их в заголовках X-DB-* и пишет строку в лог filmbase.queries
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.warning_count = getattr(settings, 'QUERY_COUNT_WARNING', 50)
+
+    def __call__(self, request):
+        stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        response['X-DB-Queries'] = stats.count
+        response['X-DB-Time'] = f'{stats.duration * 1000:.1f}ms'
+        response['X-DB-Slowest'] = f'{stats.slowest_duration * 1000:.1f}ms'
+        if stats.count > self.warning_count:
+            level = logging.WARNING
+        else:
+            # При разработке строка видна с уровнем логгера по умолчанию
+            level = logging.INFO if settings.DEBUG else logging.DEBUG
+        logger.log(level, '%s %s %s: %d queries, %.1fms, slowest %.1fms: %s',
+                   request.method, request.get_full_path(),
+                   response.status_code, stats.count,
+                   stats.duration * 1000, stats.slowest_duration * 1000,
+                   stats.slowest_sql)
+        return response
@@ -0,0 +1,44 @@
+from importlib import import_module
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+def get(budget, **kwargs):
+    return 'get', budget, kwargs, None
+
+
+def post(budget, data=None, **kwargs):
+    return 'post', budget, kwargs, data or {}
+
+
+class QueryBudgetMixin:
+    # Каждому маршруту из urls_module объявляется бюджет SQL-запросов,
+    # routes() возвращает {'app:name': get(...) | post(...)}. Маршрут без
+    # бюджета или превышение бюджета роняют тест. Запросы выполняются
+    # с пустым кешем, изменения в БД после каждого откатываются.
+    urls_module = None
+
+    def routes(self):
+        raise NotImplementedError
+
+    def test_every_route_has_budget(self):
+        module = import_module(self.urls_module)
+        names = {f'{module.app_name}:{pattern.name}'
+                 for pattern in module.urlpatterns}
+        self.assertEqual(names - set(self.routes()), set())
+
+    def test_query_budgets(self):
+        for name, (method, budget, kwargs, data) in self.routes().items():
+            with self.subTest(name):
+                url = reverse(name, kwargs=kwargs)
+                cache.clear()
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as queries:
+                        response = getattr(self.client, method)(url, data)
+                    transaction.set_rollback(True)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(
+                    len(queries), budget,
+                    '\n'.join(query['sql'] for query in queries))
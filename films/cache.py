@@ -0,0 +1,80 @@
+import hashlib
+import time
+from functools import wraps
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+# Записи кеша привязываются к тегам. У каждого тега есть версия, которая
+# входит в ключ записи; invalidate() меняет версию, и все записи с этим
+# тегом перестают находиться, без перебора и удаления ключей.
+
+# Входит в теги каждой кешированной страницы каталога. Сбрасывается
+# массовыми загрузками, которые пишут в БД мимо сигналов.
+CATALOG_TAG = 'catalog'
+# Входит в теги всех страниц фильмов. Сбрасывается правками жанра, страны
+# или персоны: их фильмов может быть сотни тысяч, по тегу на фильм не
+# напасёшься.
+FILM_PAGES_TAG = 'film-pages'
+PAGE_TIMEOUT = 24 * 3600
+
+
+def make_key(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def versions(tags):
+    keys = [f'tag:{tag}' for tag in tags]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            found[key] = time.time_ns()
+            cache.add(key, found[key], None)
+    return [found[key] for key in keys]
+
+
+def invalidate(*tags):
+    version = time.time_ns()
+    cache.set_many({f'tag:{tag}': version for tag in tags}, None)
+
+
+def cached(key, tags, compute, timeout=None):
+    key = f'{key}:{make_key(*versions(tags))}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+def cache_page(tags):
+    """Кеширует страницу для анонимных пользователей.
+
+    tags(**kwargs) по параметрам URL возвращает теги страницы, сигналы
+    сбрасывают их при изменении показанных на ней объектов.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated \
+                    or len(get_messages(request)):
+                return view(request, *args, **kwargs)
+            page_tags = [CATALOG_TAG, *tags(**kwargs)]
+            key = make_key(request.get_full_path(), versions(page_tags))
+            key = f'page:{key}'
+            page = cache.get(key)
+            if page is not None:
+                content, content_type = page
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Page-Cache'] = 'hit'
+                return response
+            response = view(request, *args, **kwargs)
+            # Страницы с CSRF-токеном у каждого свои
+            if response.status_code == 200 and not response.streaming \
+                    and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+                cache.set(key, (response.content, response['Content-Type']),
+                          PAGE_TIMEOUT)
+                response['X-Page-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
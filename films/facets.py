@@ -0,0 +1,217 @@
+import re
+import threading
+from collections import defaultdict
+from django.db import connection
+from .cache import CATALOG_TAG, versions
+from .helpers import count_tag
+from .models import Country, Film, Genre
+
+# Фасеты каталога считаются по битовым картам: бит i — i-й по id фильм.
+# Число фильмов с опцией — popcount(карта опции & карта фильтра), без
+# COUNT в БД. Индекс строится в памяти процесса и перестраивается в фоне,
+# когда сигналы сбрасывают версии тегов фильмов, стран или жанров.
+RANGES = ['year', 'length']
+# isdigit() пропускает «²» и другие цифры, которые не разбирает int()
+NUMBER = re.compile(r'[0-9]+')
+LENGTHS = [(None, 89, 'до 1,5 часов'), (90, 120, '1,5–2 часа'),
+           (121, 150, '2–2,5 часа'), (151, None, 'больше 2,5 часов')]
+
+_index = None
+_lock = threading.Lock()
+
+
+def bitmap(positions, size):
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def bitmaps(groups, size):
+    return {key: bitmap(positions, size)
+            for key, positions in groups.items()}
+
+
+def parse_filters(query):
+    """Фильтры из GET: жанры (все сразу), страна, режиссёр, диапазоны"""
+    def number(name):
+        value = query.get(name, '')
+        return int(value) if NUMBER.fullmatch(value) else None
+    filters = {'genre': sorted({int(value) for value in query.getlist('genre')
+                                if NUMBER.fullmatch(value)})}
+    for name in ['country', 'director']:
+        filters[name] = number(name)
+    for name in RANGES:
+        filters[name] = (number(f'{name}_from'), number(f'{name}_to'))
+    return filters
+
+
+def filter_films(queryset, filters):
+    """Тот же фильтр в SQL, для списка фильмов"""
+    for genre in filters['genre']:
+        queryset = queryset.filter(genres=genre)
+    for name in ['country', 'director']:
+        if filters[name] is not None:
+            queryset = queryset.filter(**{name: filters[name]})
+    for name in RANGES:
+        start, end = filters[name]
+        if start is not None:
+            queryset = queryset.filter(**{f'{name}__gte': start})
+        if end is not None:
+            queryset = queryset.filter(**{f'{name}__lte': end})
+    return queryset
+
+
+class FacetIndex:
+    def __init__(self):
+        films = list(Film.objects.order_by('id').values_list(
+            'id', 'country_id', 'director_id', 'year', 'length').iterator())
+        size = len(films)
+        self.positions = {film[0]: i for i, film in enumerate(films)}
+        self.all = (1 << size) - 1
+        groups = {name: defaultdict(list) for name in
+                  ['country', 'director', 'year', 'length', 'genre']}
+        for i, (_, country, director, year, length) in enumerate(films):
+            groups['country'][country].append(i)
+            groups['director'][director].append(i)
+            groups['year'][year].append(i)
+            groups['length'][length].append(i)
+        for film_id, genre in Film.genres.through.objects.values_list(
+                'film_id', 'genre_id').iterator():
+            if film_id in self.positions:
+                groups['genre'][genre].append(self.positions[film_id])
+        # Режиссёров много, их карты собираются по запросу
+        self.directors = groups.pop('director')
+        self.size = size
+        self.maps = {name: bitmaps(group, size)
+                     for name, group in groups.items()}
+        self.names = {'country': dict(Country.objects.values_list('id',
+                                                                  'name')),
+                      'genre': dict(Genre.objects.values_list('id', 'name'))}
+        decades = sorted({year // 10 * 10 for year in self.maps['year']
+                          if year is not None}, reverse=True)
+        self.decades = [((decade, decade + 9), f'{decade}-е',
+                         self.range('year', decade, decade + 9))
+                        for decade in decades]
+        self.lengths = [((start, end), label,
+                         self.range('length', start, end))
+                        for start, end, label in LENGTHS]
+
+    def select(self, name, value):
+        if name == 'director':
+            return bitmap(self.directors.get(value, ()), self.size)
+        return self.maps[name].get(value, 0)
+
+    def range(self, name, start, end):
+        result = 0
+        for value, positions in self.maps[name].items():
+            if value is not None and (start is None or value >= start) \
+                    and (end is None or value <= end):
+                result |= positions
+        return result
+
+    def match(self, filters, skip=None):
+        """Карта фильмов под фильтром, без фильтра группы skip"""
+        result = self.all
+        if skip != 'genre':
+            for genre in filters['genre']:
+                result &= self.select('genre', genre)
+        for name in ['country', 'director']:
+            if skip != name and filters[name] is not None:
+                result &= self.select(name, filters[name])
+        for name in RANGES:
+            if skip != name and filters[name] != (None, None):
+                result &= self.range(name, *filters[name])
+        return result
+
+    def ids(self, film_ids):
+        return bitmap((self.positions[film_id] for film_id in film_ids
+                       if film_id in self.positions), self.size)
+
+    def named(self, name, base):
+        names = self.names[name]
+        return sorted(((value, names.get(value, ''),
+                        (positions & base).bit_count())
+                       for value, positions in self.maps[name].items()),
+                      key=lambda option: option[1])
+
+    def counts(self, filters, film_ids=None):
+        """Опции фасетов: (значение, название, число фильмов).
+
+        Для страны, десятилетия и длительности фильтр своей группы не
+        применяется: счётчик показывает, сколько фильмов будет, если
+        выбрать эту опцию вместо текущей."""
+        found = self.all if film_ids is None else self.ids(film_ids)
+        year, length = (self.match(filters, name) & found
+                        for name in ['year', 'length'])
+        return {
+            'total': (self.match(filters) & found).bit_count(),
+            'genre': self.named('genre', self.match(filters) & found),
+            'country': self.named(
+                'country', self.match(filters, 'country') & found),
+            'year': [(value, label, (positions & year).bit_count())
+                     for value, label, positions in self.decades],
+            'length': [(value, label, (positions & length).bit_count())
+                       for value, label, positions in self.lengths],
+        }
+
+
+def rebuild(version):
+    # Вызывается с захваченной _lock. Версию берём до построения:
+    # изменение во время сборки вызовет ещё одну пересборку, а не потеряется
+    global _index
+    try:
+        index = FacetIndex()
+        index.version = version
+        _index = index
+    finally:
+        _lock.release()
+
+
+def rebuild_in_background(version):
+    try:
+        rebuild(version)
+    finally:
+        connection.close()
+
+
+def facet_index():
+    """Индекс фасетов. Пока он перестраивается после изменений каталога,
+    запросы получают прежний: сборка на большом каталоге занимает секунды."""
+    version = versions([CATALOG_TAG, count_tag(Film), 'countries', 'genres'])
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    if index is None:
+        # Отвечать пока нечем, первый запрос ждёт построения
+        _lock.acquire()
+        if _index is None:
+            rebuild(version)
+        else:
+            _lock.release()
+    elif _lock.acquire(blocking=False):
+        # Другой поток не увидит изменений незакоммиченной транзакции,
+        # внутри неё строим здесь же
+        if connection.in_atomic_block:
+            rebuild(version)
+        else:
+            threading.Thread(target=rebuild_in_background, args=(version,),
+                             daemon=True).start()
+    return _index
+
+
+def facet_groups(filters, counts):
+    """Группы опций для шаблона: (заголовок, имя, [(значение, название,
+    число, выбрана)]), пустые невыбранные опции не показываются"""
+    groups = []
+    for title, name in [('Жанры', 'genre'), ('Страна', 'country'),
+                        ('Годы', 'year'), ('Длительность', 'length')]:
+        selected = filters[name]
+        options = []
+        for value, label, count in counts[name]:
+            chosen = value in selected if name == 'genre' \
+                else value == selected
+            if count or chosen:
+                options.append((value, label, count, chosen))
+        groups.append((title, name, options))
+    return groups
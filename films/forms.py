@@ -39,3 +39,12 @@ class PersonForm(forms.ModelForm):
             "birthday": forms.DateInput(attrs={'type': 'date'},
                                         format="%Y-%m-%d")
         }
+
+
+class PathForm(forms.Form):
+    source = forms.ModelChoiceField(
+        Person.objects.all(), label="От кого",
+        widget=autocomplete.ModelSelect2(url='films:person_autocomplete'))
+    target = forms.ModelChoiceField(
+        Person.objects.all(), label="До кого",
+        widget=autocomplete.ModelSelect2(url='films:person_autocomplete'))
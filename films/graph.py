@@ -0,0 +1,139 @@
+from collections import Counter
+from django.db import connection
+from django.utils import timezone
+from .helpers import db_value
+from .models import Collaboration, Film
+
+# Персон в одном IN (...): не больше лимита параметров SQLite
+CHUNK = 500
+# Дальше шести рукопожатий путь не ищем
+MAX_DEPTH = 6
+
+
+def chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), CHUNK):
+        yield ids[start:start + CHUNK]
+
+
+def film_cast(films):
+    """{id фильма: (режиссёр, актёры)} для фильмов или их id"""
+    cast = {}
+    for film_id, director_id, person_id in Film.objects.filter(
+            id__in=films).order_by().values_list('id', 'director', 'people'):
+        actors = cast.setdefault(film_id, (director_id, set()))[1]
+        if person_id is not None:
+            actors.add(person_id)
+    return cast
+
+
+def rebuild():
+    """Строит граф заново по всем фильмам"""
+    qn = connection.ops.quote_name
+    now = db_value(Collaboration, 'created_at', timezone.now())
+    Collaboration.objects.all().delete()
+    # Пары участников одного фильма. UNION убирает режиссёра, снявшегося
+    # в своём фильме, чтобы фильм не считался дважды.
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH participant (film_id, person_id) AS (
+                SELECT film_id, person_id
+                FROM {qn(Film.people.through._meta.db_table)}
+                UNION
+                SELECT id, director_id FROM {qn(Film._meta.db_table)})
+            INSERT INTO {qn(Collaboration._meta.db_table)}
+                (person_id, partner_id, films, created_at, updated_at)
+            SELECT a.person_id, b.person_id, COUNT(*), %s, %s
+            FROM participant a JOIN participant b
+                ON a.film_id = b.film_id AND a.person_id <> b.person_id
+            GROUP BY a.person_id, b.person_id""", [now, now])
+
+
+def pair_delta(delta, people, changed, sign):
+    # Пары, в которых есть хотя бы одна персона из changed
+    for a in changed:
+        for b in people:
+            if a != b:
+                delta[a, b] += sign
+                if b not in changed:
+                    delta[b, a] += sign
+
+
+def update(changes):
+    """Применяет изменения составов фильмов [(было, стало), ...].
+
+    Состав — множество участников (актёры и режиссёр). Меняются только
+    рёбра добавленных и убранных персон. Возвращает персоны, чьи списки
+    коллег изменились."""
+    delta = Counter()
+    for before, after in changes:
+        before, after = set(before) - {None}, set(after) - {None}
+        pair_delta(delta, after, after - before, 1)
+        pair_delta(delta, before, before - after, -1)
+    now = db_value(Collaboration, 'updated_at', timezone.now())
+    added = [(a, b, count, now, now)
+             for (a, b), count in delta.items() if count > 0]
+    removed = [(-count, now, a, b)
+               for (a, b), count in delta.items() if count < 0]
+    table = connection.ops.quote_name(Collaboration._meta.db_table)
+    with connection.cursor() as cursor:
+        if added:
+            cursor.executemany(
+                f'INSERT INTO {table} '
+                f'(person_id, partner_id, films, created_at, updated_at) '
+                f'VALUES (%s, %s, %s, %s, %s) '
+                f'ON CONFLICT (person_id, partner_id) DO UPDATE '
+                f'SET films = {table}.films + excluded.films, '
+                f'updated_at = excluded.updated_at', added)
+        if removed:
+            cursor.executemany(
+                f'UPDATE {table} SET films = films - %s, updated_at = %s '
+                f'WHERE person_id = %s AND partner_id = %s', removed)
+    for chunk in chunks({row[2] for row in removed}):
+        Collaboration.objects.filter(person__in=chunk, films=0).delete()
+    return {a for (a, b), count in delta.items() if count}
+
+
+def neighbours(people):
+    for chunk in chunks(people):
+        yield from Collaboration.objects.filter(person__in=chunk) \
+            .order_by().values_list('person_id', 'partner_id').iterator()
+
+
+def shortest_path(source, target, max_depth=MAX_DEPTH):
+    """Цепочка id персон от source до target или None.
+
+    Поиск в ширину с двух концов, каждый шаг расширяет меньший фронт."""
+    if source == target:
+        return [source]
+    parents = ({source: None}, {target: None})
+    frontiers = [[source], [target]]
+    for _ in range(max_depth):
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        visited, other = parents[side], parents[1 - side]
+        frontier = []
+        for person, partner in neighbours(frontiers[side]):
+            if partner in visited:
+                continue
+            visited[partner] = person
+            if partner in other:
+                return join_path(parents, partner)
+            frontier.append(partner)
+        if not frontier:
+            return None
+        frontiers[side] = frontier
+    return None
+
+
+def join_path(parents, middle):
+    path = []
+    person = middle
+    while person is not None:
+        path.append(person)
+        person = parents[0][person]
+    path.reverse()
+    person = parents[1][middle]
+    while person is not None:
+        path.append(person)
+        person = parents[1][person]
+    return path
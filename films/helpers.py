@@ -1,8 +1,63 @@
+import base64
+import binascii
+import json
+from functools import wraps
+from math import ceil
+from django.contrib.messages import get_messages
+from django.core.exceptions import EmptyResultSet, ValidationError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import connection
+from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.functional import cached_property
+from django.utils.http import http_date, quote_etag
+from .cache import CATALOG_TAG, cached, invalidate, make_key, versions
 
+# Точнее этого число строк не считаем: дальше выводим «более N страниц»
+COUNT_LIMIT = 10000
+COUNT_TIMEOUT = 60 * 60
 
-def paginate(request, collection, per=12):
-    paginator = Paginator(collection, per)
+
+def count_tag(model):
+    return f'count:{model._meta.label_lower}'
+
+
+def invalidate_counts(model):
+    invalidate(count_tag(model))
+
+
+def cached_count(request, collection):
+    # Возвращает (число строк, точное ли оно). Кеш разделён по view и
+    # тексту запроса и сбрасывается сигналами при изменении модели.
+    try:
+        sql, params = collection.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, True
+    view = request.resolver_match.view_name if request.resolver_match else ''
+    key = f'count:{make_key(view, sql, params)}'
+    count = cached(key, [count_tag(collection.model)],
+                   lambda: collection.order_by()[:COUNT_LIMIT + 1].count(),
+                   COUNT_TIMEOUT)
+    return min(count, COUNT_LIMIT), count <= COUNT_LIMIT
+
+
+class CachedCountPaginator(Paginator):
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request = request
+        self.count_is_exact = True
+
+    @cached_property
+    def count(self):
+        count, self.count_is_exact = cached_count(self.request,
+                                                  self.object_list)
+        return count
+
+
+def paginate(request, collection, per=12, keyset=None):
+    if keyset:
+        return paginate_keyset(request, collection, keyset, per)
+    paginator = CachedCountPaginator(request, collection, per)
     page = request.GET.get('page')
     try:
         collection = paginator.page(page)
@@ -11,3 +66,169 @@ def paginate(request, collection, per=12):
     except EmptyPage:
         collection = paginator.page(paginator.num_pages)
     return collection
+
+
+class CursorPage:
+    def __init__(self, object_list, number, next_cursor, previous_cursor,
+                 count, count_is_exact, per):
+        self.object_list = object_list
+        self.number = number
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+        self.count_is_exact = count_is_exact
+        self.num_pages = max(ceil(count / per), 1)
+
+    def __repr__(self):
+        return f'<CursorPage {self.number}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(direction, values, number):
+    # default=str сохраняет микросекунды у дат, в отличие от DjangoJSONEncoder
+    data = json.dumps([direction, values, number], default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, values, number = json.loads(data)
+        number = max(int(number), 1)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        return None
+    return direction, values, number
+
+
+def keyset_filter(keyset, values, reverse=False):
+    # Строки, которые идут после values в порядке keyset
+    # (или перед ними, если reverse): (a > x) OR (a = x AND b > y) ...
+    condition = Q()
+    for i, field in enumerate(keyset):
+        name = field.lstrip('-')
+        descending = field.startswith('-') != reverse
+        step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[i]})
+        for previous, value in zip(keyset[:i], values[:i]):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
+
+
+def reverse_ordering(keyset):
+    return [field[1:] if field.startswith('-') else f'-{field}'
+            for field in keyset]
+
+
+def paginate_keyset(request, collection, keyset, per=12):
+    # Постраничный вывод по курсору: вместо OFFSET фильтруем по значениям
+    # ключа сортировки последней строки, поэтому любая страница стоит
+    # как первая. Ключ должен быть уникальным (обычно оканчивается на id).
+    collection = collection.order_by(*keyset)
+    cursor = decode_cursor(request.GET.get('cursor', ''))
+    if cursor and len(cursor[1]) == len(keyset):
+        direction, values, number = cursor
+        try:
+            if direction == 'next':
+                page = collection.filter(keyset_filter(keyset, values))
+            else:
+                page = collection.order_by(*reverse_ordering(keyset)) \
+                    .filter(keyset_filter(keyset, values, reverse=True))
+        except (TypeError, ValueError, ValidationError):
+            cursor = None
+    else:
+        cursor = None
+    if cursor is None:
+        direction, number = 'next', 1
+        page = collection
+    rows = list(page[:per + 1])
+    more = len(rows) > per
+    rows = rows[:per]
+    if direction == 'prev':
+        rows.reverse()
+    has_next = more if direction == 'next' else True
+    has_previous = cursor is not None if direction == 'next' else more
+    if direction == 'prev' and not more:
+        number = 1
+
+    def key(obj):
+        return [getattr(obj, field.lstrip('-')) for field in keyset]
+
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor('next', key(rows[-1]), number + 1)
+    if rows and has_previous:
+        previous_cursor = encode_cursor('prev', key(rows[0]),
+                                        max(number - 1, 1))
+    count, count_is_exact = cached_count(request, collection)
+    return CursorPage(rows, number, next_cursor, previous_cursor,
+                      count, count_is_exact, per)
+
+
+def db_value(model, field, value):
+    return model._meta.get_field(field).get_db_prep_save(value, connection)
+
+
+def insert_rows(model, fields, rows):
+    # Вставка кортежей мимо ORM: без объектов моделей, pre_save и
+    # сигналов. Значения должны быть уже подготовлены для БД (db_value).
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(model._meta.get_field(field).column)
+                        for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {qn(model._meta.db_table)} '
+                           f'({columns}) VALUES ({placeholders})', rows)
+
+
+def conditional_page(tags):
+    """ETag и Last-Modified для страницы, 304 на повторный запрос.
+
+    tags(**kwargs) — те же теги, что у cache_page: ETag собирается из их
+    версий и не требует запросов к БД. Страница зависит от пользователя,
+    поэтому он входит в ETag, а Last-Modified отдаётся только анонимным.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') \
+                    or len(get_messages(request)):
+                return view(request, *args, **kwargs)
+            page_versions = versions([CATALOG_TAG, *tags(**kwargs)])
+            user = request.user
+            etag = quote_etag(make_key(user.pk, user.is_superuser,
+                                       page_versions))
+            last_modified = None
+            if not user.is_authenticated:
+                # Версия тега — время сброса в наносекундах
+                last_modified = max(page_versions) // 10 ** 9
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    response.headers.setdefault('ETag', etag)
+                    if last_modified:
+                        response.headers.setdefault(
+                            'Last-Modified', http_date(last_modified))
+            return response
+        return wrapper
+    return decorator
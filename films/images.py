@@ -0,0 +1,74 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from .graph import chunks
+from .models import ImageSource
+
+WORKERS = 8
+TIMEOUT = 30
+MAX_URL = ImageSource._meta.get_field('url').max_length
+
+
+class ImageDownloader:
+    # Параллельно качает картинки по URL в MEDIA_ROOT. Каждый URL
+    # скачивается один раз: скачанные запоминаются в ImageSource, файл
+    # называется хешем содержимого, поэтому одинаковые картинки не
+    # записываются повторно.
+    def __init__(self, workers=WORKERS, timeout=TIMEOUT, storage=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.storage = storage or default_storage
+        self.names = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def session(self):
+        # Session не потокобезопасна, у каждого потока своя со своим
+        # пулом keep-alive соединений
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def fetch(self, url, upload_to):
+        try:
+            response = self.session().get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f'Image {url} failed: {e}')
+            return None
+        digest = hashlib.sha256(response.content).hexdigest()
+        extension = os.path.splitext(urlparse(url).path)[1].lower() or '.jpg'
+        name = f'{upload_to}{digest}{extension}'
+        with self.lock:
+            if not self.storage.exists(name):
+                self.storage.save(name, ContentFile(response.content))
+        return name
+
+    def download(self, urls):
+        """Скачивает {url: upload_to}, возвращает {url: имя файла или None}"""
+        todo = {url: upload_to for url, upload_to in urls.items()
+                if url not in self.names}
+        for chunk in chunks(todo):
+            for url, name in ImageSource.objects.filter(url__in=chunk) \
+                    .values_list('url', 'name'):
+                # Файл могли удалить, тогда качаем заново
+                if self.storage.exists(name):
+                    self.names[url] = name
+                    del todo[url]
+        if todo:
+            with ThreadPoolExecutor(self.workers) as pool:
+                names = dict(zip(todo, pool.map(self.fetch, todo.keys(),
+                                                todo.values())))
+            self.names.update(names)
+            ImageSource.objects.bulk_create(
+                [ImageSource(url=url, name=name)
+                 for url, name in names.items()
+                 if name and len(url) <= MAX_URL],
+                update_conflicts=True, unique_fields=['url'],
+                update_fields=['name', 'updated_at'])
+        return {url: self.names[url] for url in urls}
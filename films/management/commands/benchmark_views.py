@@ -0,0 +1,206 @@
+import json
+import statistics
+import subprocess
+import time
+import tracemalloc
+from importlib import import_module
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from films.models import Country, Genre, Film
+from news.models import News, NewsBlock, Comment
+
+URL_MODULES = ['films.urls', 'news.urls', 'signup.urls']
+# GET на эти маршруты меняет данные, reaction_toggle принимает только POST
+SKIP = {'news:news_reaction_create', 'news:comment_reaction_create',
+        'news:reaction_toggle'}
+# Параметр маршрута → объект из get_samples()
+ROUTE_SAMPLES = {
+    **{f'films:{model}_{action}': {'id': model}
+       for model in ['country', 'genre', 'film', 'person']
+       for action in ['detail', 'update', 'delete']},
+    **{f'news:{name}': {'id': 'news'}
+       for name in ['news_detail', 'news_update', 'news_delete',
+                    'comment_create', 'comment_list']},
+    # Два маршрута с одним именем: от блока и от новости
+    'news:news_block_create': {'block_id': 'block', 'news_id': 'news'},
+    'news:news_block_update': {'block_id': 'block'},
+    'news:news_block_delete': {'block_id': 'block'},
+    'news:comment_update': {'comment_id': 'comment'},
+    'news:comment_delete': {'comment_id': 'comment'},
+}
+SESSIONS = ['anonymous', 'user', 'superuser']
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, queries and memory of every public view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--sessions', default=','.join(SESSIONS))
+        parser.add_argument('--routes', default='',
+                            help='Only routes containing this substring')
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Clear the cache before every request')
+        parser.add_argument('--output', default='bench_output.json')
+        parser.add_argument('--compare',
+                            help='Previous JSON result to compare with')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('Need at least 2 iterations for percentiles')
+        self.options = options
+        self.samples = self.get_samples()
+        routes = [route for route in self.get_routes()
+                  if options['routes'] in route[0]]
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for session in options['sessions'].split(','):
+                client = self.get_client(session)
+                results[session] = {}
+                for name, url in routes:
+                    results[session][name] = self.measure(client, url)
+                    self.report(session, name, results[session][name])
+        data = {'meta': self.get_meta(), 'results': results}
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(options['output'])
+        if options['compare']:
+            self.compare(options['compare'], data)
+
+    def get_samples(self):
+        film = Film.objects.order_by('id')[Film.objects.count() // 2:].first()
+        # Для новостей берём самую обсуждаемую: худший случай для
+        # страницы с комментариями
+        news_id = (Comment.objects.values('news')
+                   .annotate(comments=Count('id'))
+                   .order_by('-comments')
+                   .values_list('news', flat=True)[:1])
+        news = News.objects.filter(id__in=news_id).first() \
+            or News.objects.first()
+        if film is None or news is None:
+            raise CommandError('Database is empty, run generate_catalog '
+                               'and generate_news first')
+        genre = Genre.objects.filter(film=film).first()
+        block = NewsBlock.objects.filter(news=news).first()
+        comment = Comment.objects.filter(news=news).first()
+        return {
+            'film': film.id,
+            'person': film.director_id,
+            'country': film.country_id,
+            'genre': genre and genre.id,
+            'news': news.id,
+            'block': block and block.id,
+            'comment': comment and comment.id,
+        }
+
+    def get_routes(self):
+        routes = []
+        for module_name in URL_MODULES:
+            module = import_module(module_name)
+            for pattern in module.urlpatterns:
+                name = f'{module.app_name}:{pattern.name}'
+                if name in SKIP:
+                    continue
+                samples = ROUTE_SAMPLES.get(name, {})
+                kwargs = {}
+                for param in pattern.pattern.converters:
+                    if param not in samples:
+                        raise CommandError(f'No sample for {param} of {name}, '
+                                           f'add it to ROUTE_SAMPLES')
+                    kwargs[param] = self.samples[samples[param]]
+                if None in kwargs.values():
+                    print(f'Skipping {name}: no sample object')
+                    continue
+                url = reverse(name, kwargs=kwargs)
+                if name in dict(routes):
+                    # Одно имя у нескольких маршрутов
+                    name = f'{name} ({pattern.pattern})'
+                routes.append((name, url))
+        return routes
+
+    def get_client(self, session):
+        client = Client(raise_request_exception=False)
+        if session == 'anonymous':
+            return client
+        User = get_user_model()
+        user, _ = User.objects.get_or_create(
+            username=f'benchmark_{session}',
+            defaults={'is_superuser': session == 'superuser',
+                      'is_staff': session == 'superuser'})
+        client.force_login(user)
+        return client
+
+    def request(self, client, url):
+        if self.options['cold_cache']:
+            cache.clear()
+        return client.get(url)
+
+    def measure(self, client, url):
+        for _ in range(self.options['warmup']):
+            self.request(client, url)
+        timings = []
+        for _ in range(self.options['iterations']):
+            start = time.perf_counter()
+            response = self.request(client, url)
+            timings.append((time.perf_counter() - start) * 1000)
+        tracemalloc.start()
+        current = tracemalloc.get_traced_memory()[0]
+        self.request(client, url)
+        peak = tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'url': url,
+            'status': response.status_code,
+            'p50': round(percentiles[49], 2),
+            'p95': round(percentiles[94], 2),
+            'p99': round(percentiles[98], 2),
+            'queries': int(response.get('X-DB-Queries', -1)),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def get_meta(self):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                    capture_output=True, text=True).stdout
+        except OSError:
+            commit = ''
+        return {
+            'date': timezone.now().isoformat(),
+            'commit': commit.strip(),
+            'iterations': self.options['iterations'],
+            'cold_cache': self.options['cold_cache'],
+            'films': Film.objects.count(),
+            'countries': Country.objects.count(),
+            'news': News.objects.count(),
+            'comments': Comment.objects.count(),
+        }
+
+    @staticmethod
+    def report(session, name, result):
+        print(f'{session:10} {name:32} {result["status"]} '
+              f'p50={result["p50"]:8.2f}ms p95={result["p95"]:8.2f}ms '
+              f'p99={result["p99"]:8.2f}ms q={result["queries"]:4} '
+              f'mem={result["peak_memory_kb"]:9.1f}KB')
+
+    @staticmethod
+    def compare(path, data):
+        with open(path, encoding='utf-8') as f:
+            previous = json.load(f)['results']
+        print(f'\nCompared with {path}:')
+        for session, results in data['results'].items():
+            for name, result in results.items():
+                before = previous.get(session, {}).get(name)
+                if not before:
+                    continue
+                change = (result['p50'] - before['p50']) / before['p50'] * 100
+                print(f'{session:10} {name:32} '
+                      f'p50 {before["p50"]:8.2f} -> {result["p50"]:8.2f}ms '
+                      f'({change:+6.1f}%) '
+                      f'q {before["queries"]:4} -> {result["queries"]:4}')
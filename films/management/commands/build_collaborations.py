@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from films import graph
+from films.cache import CATALOG_TAG, invalidate
+from films.models import Collaboration
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the collaboration graph from all films'
+
+    def handle(self, *args, **options):
+        # Обычно граф обновляется вместе с фильмами, полная пересборка
+        # нужна после первой миграции и правок мимо ORM
+        start = time.perf_counter()
+        with transaction.atomic():
+            graph.rebuild()
+        invalidate(CATALOG_TAG)
+        print(f'{Collaboration.objects.count()} edges in '
+              f'{time.perf_counter() - start:.1f}s')
@@ -0,0 +1,68 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from films.cache import CATALOG_TAG, invalidate
+from films.helpers import db_value, insert_rows
+from films.models import Film, SimilarFilm
+
+try:
+    import numpy as np
+    from films.similar import TOP_K, SimilarityIndex
+except ImportError:
+    np = None
+    TOP_K = 12
+
+
+class Command(BaseCommand):
+    help = 'Build the "similar films" table with NumPy/SciPy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only films changed since the last build '
+                                 'and the films whose lists they affect')
+        parser.add_argument('--top', type=int, default=TOP_K)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('build_similar requires numpy and scipy')
+        start = time.perf_counter()
+        # Время начала сборки записывается в created_at строк: фильмы,
+        # изменённые во время сборки, попадут в следующую инкрементальную
+        self.now = db_value(SimilarFilm, 'created_at', timezone.now())
+        since = SimilarFilm.objects.aggregate(Max('created_at'))[
+            'created_at__max'] if options['incremental'] else None
+        index = SimilarityIndex(options['top'])
+        if since is None:
+            rows = np.arange(len(index))
+        else:
+            changed = list(Film.objects.filter(updated_at__gt=since)
+                           .values_list('id', flat=True))
+            rows = index.affected(changed)
+            print(f'{len(changed)} films changed since {since}')
+        with transaction.atomic():
+            if since is None:
+                SimilarFilm.objects.all().delete()
+            self.write(index, rows, since is not None, options['batch_size'])
+        invalidate(CATALOG_TAG)
+        print(f'{len(rows)} films in {time.perf_counter() - start:.1f}s')
+
+    def write(self, index, rows, replace, batch_size):
+        fields = ('film', 'similar', 'score', 'created_at', 'updated_at')
+        batch, films = [], []
+        for film_id, similar in index.neighbours(rows):
+            films.append(int(film_id))
+            batch.extend((int(film_id), similar_id, score, self.now, self.now)
+                         for similar_id, score in similar)
+            if len(batch) >= batch_size or len(films) >= batch_size:
+                self.flush(fields, batch, films, replace)
+                batch, films = [], []
+        self.flush(fields, batch, films, replace)
+
+    @staticmethod
+    def flush(fields, batch, films, replace):
+        if replace:
+            SimilarFilm.objects.filter(film__in=films).delete()
+        insert_rows(SimilarFilm, fields, batch)
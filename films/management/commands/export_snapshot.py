@@ -0,0 +1,54 @@
+import gzip
+import json
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+# В порядке загрузки: сначала те, на кого ссылаются
+MODELS = ['auth.User', 'films.Country', 'films.Genre', 'films.Person',
+          'films.Film', 'films.Film_genres', 'films.Film_people',
+          'films.SimilarFilm', 'films.Collaboration', 'news.News',
+          'news.NewsBlock', 'news.Comment', 'news.Reaction']
+
+
+def snapshot_models():
+    return [apps.get_model(label) for label in MODELS]
+
+
+class Command(BaseCommand):
+    help = 'Dump catalogue, news and users to a NDJSON snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='snapshot.ndjson.gz',
+                            help='Compressed with gzip if ends with .gz')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        # Для каждой модели строка {"model": ..., "fields": [...]},
+        # затем по строке-массиву значений на запись
+        output = options['output']
+        opener = gzip.open if output.endswith('.gz') else open
+        with opener(output, 'wt', encoding='utf-8') as f:
+            for model in snapshot_models():
+                total = self.export_model(f, model, options['batch_size'])
+                print(f'{model._meta.label} {total}')
+        print(output)
+
+    @staticmethod
+    def export_model(f, model, batch_size):
+        fields = [field.attname for field in model._meta.concrete_fields]
+        f.write(json.dumps({'model': model._meta.label, 'fields': fields})
+                + '\n')
+        rows = model._base_manager.order_by('pk').values_list(*fields)
+        pk = fields.index(model._meta.pk.attname)
+        total = 0
+        last = None
+        while True:
+            # Пачками по первичному ключу, без OFFSET
+            chunk = rows if last is None else rows.filter(pk__gt=last)
+            chunk = list(chunk[:batch_size])
+            if not chunk:
+                return total
+            f.writelines(json.dumps(row, ensure_ascii=False, default=str)
+                         + '\n' for row in chunk)
+            total += len(chunk)
+            last = chunk[-1][pk]
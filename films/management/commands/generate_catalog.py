@@ -0,0 +1,141 @@
+import datetime
+import random
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from films import graph
+from films.cache import CATALOG_TAG, invalidate
+from films.helpers import db_value, insert_rows, invalidate_counts
+from films.models import Country, Genre, Person, Film
+
+COUNTRIES = ['США', 'Россия', 'СССР', 'Франция', 'Великобритания',
+             'Германия', 'Италия', 'Япония', 'Южная Корея', 'Индия',
+             'Испания', 'Канада', 'Китай', 'Швеция', 'Дания', 'Австралия']
+GENRES = ['драма', 'комедия', 'боевик', 'триллер', 'мелодрама', 'фантастика',
+          'криминал', 'детектив', 'приключения', 'ужасы', 'фэнтези',
+          'мультфильм', 'семейный', 'военный', 'история', 'биография',
+          'вестерн', 'мюзикл', 'спорт', 'документальный']
+FIRST_NAMES = [('Иван', 'Ivan'), ('Анна', 'Anna'), ('Михаил', 'Mikhail'),
+               ('Мария', 'Maria'), ('Джон', 'John'), ('Эмма', 'Emma'),
+               ('Роберт', 'Robert'), ('Ольга', 'Olga'), ('Том', 'Tom'),
+               ('Кейт', 'Kate'), ('Сергей', 'Sergey'), ('Натали', 'Natalie'),
+               ('Жан', 'Jean'), ('Софи', 'Sophie'), ('Такеши', 'Takeshi')]
+SYLLABLES = [('ка', 'ka'), ('ло', 'lo'), ('ми', 'mi'), ('ре', 're'),
+             ('то', 'to'), ('на', 'na'), ('вер', 'ver'), ('сон', 'son'),
+             ('бер', 'ber'), ('ин', 'in'), ('ков', 'kov'), ('ман', 'man')]
+WORDS = ['тень', 'город', 'ночь', 'последний', 'дорога', 'время', 'остров',
+         'война', 'любовь', 'секрет', 'зеркало', 'небо', 'река', 'охота',
+         'память', 'игра', 'побег', 'сердце', 'ветер', 'звезда']
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic catalogue for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=50000)
+        parser.add_argument('--people', type=int, default=200000)
+        parser.add_argument('--countries', type=int, default=60)
+        parser.add_argument('--genres', type=int, default=30)
+        parser.add_argument('--actors', type=int, default=12,
+                            help='Average number of actors per film')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = db_value(Film, 'created_at', timezone.now())
+        countries = self.create_named(Country, COUNTRIES, 'Страна',
+                                      options['countries'])
+        genres = self.create_named(Genre, GENRES, 'жанр', options['genres'])
+        people = self.create_people(options['people'])
+        self.create_films(options['films'], countries, genres, people,
+                          options['actors'])
+        print('Collaborations')
+        with transaction.atomic():
+            graph.rebuild()
+        invalidate_counts(Film)
+        invalidate_counts(Person)
+        invalidate(CATALOG_TAG)
+
+    def next_id(self, model):
+        return (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+    def create_named(self, model, names, prefix, count):
+        names = names + [f'{prefix} {i}' for i in range(len(names), count)]
+        names = names[:count]
+        existing = set(model.objects.filter(name__in=names)
+                       .values_list('name', flat=True))
+        model.objects.bulk_create(
+            [model(name=name) for name in names if name not in existing])
+        return list(model.objects.filter(name__in=names)
+                    .values_list('id', flat=True))
+
+    def person_name(self):
+        first, en_first = self.rng.choice(FIRST_NAMES)
+        parts = self.rng.sample(SYLLABLES, self.rng.randint(2, 3))
+        last = ''.join(part[0] for part in parts).capitalize()
+        en_last = ''.join(part[1] for part in parts).capitalize()
+        return f'{first} {last}', f'{en_first} {en_last}'
+
+    def chunks(self, total):
+        for start in range(0, total, self.batch_size):
+            yield start, min(start + self.batch_size, total)
+
+    def create_people(self, count):
+        first_id = self.next_id(Person)
+        for start, end in self.chunks(count):
+            rows = []
+            for i in range(start, end):
+                name, origin_name = self.person_name()
+                birthday = None
+                if self.rng.random() < 0.7:
+                    birthday = datetime.date(1900, 1, 1) + datetime.timedelta(
+                        days=self.rng.randint(0, 365 * 105))
+                rows.append((first_id + i, name, origin_name,
+                             db_value(Person, 'birthday', birthday),
+                             self.now, self.now))
+            with transaction.atomic():
+                insert_rows(Person, ('id', 'name', 'origin_name', 'birthday',
+                                     'created_at', 'updated_at'), rows)
+            print(f'PERSON {end}/{count}')
+        return range(first_id, first_id + count)
+
+    def popular(self, people):
+        # Степенное распределение: небольшая часть персон снимается
+        # в большинстве фильмов, как в реальном каталоге
+        return people[int(len(people) * self.rng.random() ** 3)]
+
+    def create_films(self, count, countries, genres, people, actors):
+        first_id = self.next_id(Film)
+        directors = people[:max(len(people) // 10, 1)]
+        for start, end in self.chunks(count):
+            films, film_genres, film_people = [], [], []
+            for i in range(start, end):
+                film_id = first_id + i
+                title = ' '.join(self.rng.sample(WORDS,
+                                                 self.rng.randint(1, 3)))
+                films.append((
+                    film_id, f'{title.capitalize()} {film_id}',
+                    f'Film {film_id}', self.rng.choice([None, f'{title}!']),
+                    self.popular(countries), self.popular(directors),
+                    self.rng.randint(70, 200), self.rng.randint(1920, 2025),
+                    ' '.join(self.rng.choices(WORDS, k=30)),
+                    self.now, self.now))
+                for genre_id in {self.popular(genres)
+                                 for _ in range(self.rng.randint(1, 3))}:
+                    film_genres.append((film_id, genre_id))
+                cast = self.rng.randint(1, actors * 2)
+                for person_id in {self.popular(people) for _ in range(cast)}:
+                    film_people.append((film_id, person_id))
+            with transaction.atomic():
+                insert_rows(Film, ('id', 'name', 'origin_name', 'slogan',
+                                   'country', 'director', 'length', 'year',
+                                   'description', 'created_at', 'updated_at'),
+                            films)
+                insert_rows(Film.genres.through, ('film', 'genre'),
+                            film_genres)
+                insert_rows(Film.people.through, ('film', 'person'),
+                            film_people)
+            print(f'FILM {end}/{count}')
@@ -1,68 +1,134 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import requests
 import json
+from films.poiskkino import BASE_URL, APIError, PoiskKino
+
+MOVIE_FIELDS = ["id", "name", "enName", "year", "description", "movieLength",
+                "countries", "genres", "persons", "poster", "slogan",
+                "videos"]
 
 
 class Command(BaseCommand):
     help = 'Download json via https://api.poiskkino.dev'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--list', default='top250',
+                            help='Collection slug, e.g. top250')
+        parser.add_argument('--all', action='store_true',
+                            help='Whole catalogue instead of one list')
+        parser.add_argument('--output', default=self.filename())
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--rate', type=float, default=5,
+                            help='Requests per second, 0 for no limit')
+        parser.add_argument('--retries', type=int, default=5)
+        parser.add_argument('--backoff', type=float, default=1.0,
+                            help='First retry delay in seconds')
+        parser.add_argument('--base-url', default=BASE_URL)
+
     def handle(self, *args, **options):
-        movies = self.get_movies()
-        with open(self.filename(), "w", encoding="utf-8") as f:
-            json.dump(movies, f, ensure_ascii=False, indent=4)
-        print(self.filename())
+        self.api = PoiskKino(options['base_url'], options['rate'],
+                             options['retries'], options['backoff'])
+        self.params = {"selectFields": MOVIE_FIELDS, "type": "movie"}
+        if not options['all']:
+            self.params["lists"] = options['list']
+        output = options['output']
+        # Страницы дописываются в .part построчно, в .checkpoint — какие
+        # страницы готовы и размер .part после них. Прерванный запуск
+        # продолжается с того же места.
+        self.part_path = f'{output}.part'
+        self.checkpoint_path = f'{output}.checkpoint'
+        try:
+            self.get_movies(options['workers'])
+        except APIError as e:
+            raise CommandError(f'{e}. Run the command again to resume')
+        self.finalize(output)
+        print(output)
 
     @staticmethod
     def filename():
         return "films/data/films.json"
 
-    @staticmethod
-    def headers():
-        return {"X-API-KEY": os.environ.get("POISKKINO_DEV_TOKEN")}
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if checkpoint['params'] != self.params \
+                or not os.path.exists(self.part_path):
+            return None
+        print(f"Resuming: {len(checkpoint['done'])}/{checkpoint['pages']} "
+              f"pages done")
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint):
+        tmp = f'{self.checkpoint_path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def get_page(self, page):
+        data = self.api.movies(self.params, page)
+        if data['docs']:
+            birthdays = self.api.birthdays(
+                {film_data['id'] for film_data in data['docs']})
+            for film_data in data['docs']:
+                for person_data in film_data['persons']:
+                    if person_data['id'] in birthdays:
+                        person_data['birthday'] = birthdays[person_data['id']]
+        return page, data['pages'], data['docs']
 
-    def get_birthdays(self, movie_ids):
-        res = {}
-        params = {
-            "selectFields": ["id", "birthday"],
-            "notNullFields": ["birthday"],
-            "limit": 250,
-            "movies.id": movie_ids,
-            "page": 1
-        }
-        while True:
-            print(params["page"])
-            resp = requests.get(
-                "https://api.poiskkino.dev/v1.4/person",
-                headers=self.headers(), params=params)
-            json = resp.json()
-            for data in json['docs']:
-                res[data['id']] = data['birthday']
-            params["page"] += 1
-            if params["page"] > json['pages']:
-                break
-        return res
+    def write_page(self, part, checkpoint, page, docs):
+        for film_data in docs:
+            part.write(json.dumps(film_data, ensure_ascii=False) + '\n')
+        part.flush()
+        os.fsync(part.fileno())
+        checkpoint['done'].append(page)
+        checkpoint['size'] = part.tell()
+        self.save_checkpoint(checkpoint)
+        print(f"PAGE {page}/{checkpoint['pages']}")
 
-    def get_movies(self):
-        params = {
-            "selectFields": ["id", "name", "enName", "year", "description",
-                             "movieLength", "countries",  "genres", "persons",
-                             "poster", "slogan", "videos"],
-            "type": "movie",
-            "lists": "top250",
-            "limit": 250
+    def get_movies(self, workers):
+        checkpoint = self.load_checkpoint()
+        with open(self.part_path, 'a+', encoding='utf-8') as part:
+            if checkpoint is None:
+                part.truncate(0)
+                page, pages, docs = self.get_page(1)
+                checkpoint = {'params': self.params, 'pages': pages,
+                              'done': [], 'size': 0}
+                self.write_page(part, checkpoint, page, docs)
+            else:
+                # Отбрасываем страницу, записанную не до конца
+                part.truncate(checkpoint['size'])
+            pending = set(range(1, checkpoint['pages'] + 1)) \
+                - set(checkpoint['done'])
+            pool = ThreadPoolExecutor(workers)
+            try:
+                futures = [pool.submit(self.get_page, page)
+                           for page in sorted(pending)]
+                for future in as_completed(futures):
+                    page, pages, docs = future.result()
+                    self.write_page(part, checkpoint, page, docs)
+            finally:
+                pool.shutdown(cancel_futures=True)
 
-        }
-        resp = requests.get(
-            "https://api.poiskkino.dev/v1.4/movie",
-            headers=self.headers(), params=params)
-        json = resp.json()
-        movie_ids = set()
-        for film_data in json['docs']:
-            movie_ids.add(film_data["id"])
-        birthdays = self.get_birthdays(movie_ids)
-        for film_data in json['docs']:
-            for person_data in film_data['persons']:
-                if person_data['id'] in birthdays:
-                    person_data['birthday'] = birthdays[person_data['id']]
-        return json
+    def finalize(self, output):
+        # Собираем {"docs": [...]} построчно, не загружая всё в память.
+        # Каталог может сдвинуться между страницами, повторы отбрасываем.
+        seen = set()
+        tmp = f'{output}.tmp'
+        with open(self.part_path, encoding='utf-8') as part, \
+                open(tmp, 'w', encoding='utf-8') as f:
+            f.write('{"docs": [\n')
+            for line in part:
+                film_id = json.loads(line)['id']
+                if film_id in seen:
+                    continue
+                f.write(',\n' if seen else '')
+                f.write(line.rstrip('\n'))
+                seen.add(film_id)
+            f.write('\n]}\n')
+        os.replace(tmp, output)
+        os.remove(self.part_path)
+        os.remove(self.checkpoint_path)
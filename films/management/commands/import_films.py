@@ -1,97 +1,257 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+import hashlib
 import json
-import os
-from urllib.request import urlopen
-from urllib.error import HTTPError
-from django.core.files import File
-from django.core.files.temp import NamedTemporaryFile
+from collections import Counter, defaultdict
+from itertools import islice
+from django.db import transaction
+from films import graph
+from films.cache import CATALOG_TAG, invalidate
+from films.helpers import invalidate_counts
+from films.images import WORKERS, ImageDownloader
 from films.models import Country, Genre, Person, Film
+from films.readers import iter_docs
 from .get_films import Command as GetCommand
 
+PERSON_FIELDS = ['name', 'origin_name', 'birthday', 'source_hash']
+FILM_FIELDS = ['name', 'origin_name', 'slogan', 'length', 'description',
+               'year', 'trailer_url', 'director', 'country', 'source_hash']
+# Поля персоны, которые не зависят от фильма, в котором она указана
+PERSON_SOURCE = ['name', 'enName', 'birthday', 'photo']
+PRUNE_CHUNK = 500
+
+
+def fingerprint(data):
+    return hashlib.sha256(json.dumps(
+        data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
 
 class Command(BaseCommand):
     help = 'Import films from json file'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=GetCommand.filename(),
+                            help='JSON or NDJSON, optionally .gz/.zst')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=WORKERS,
+                            help='Parallel image downloads')
+        parser.add_argument('--force', action='store_true',
+                            help='Rewrite records even if unchanged')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete films missing from the file')
+
     def handle(self, *args, **options):
-        self.create_films()
+        # Кэш name -> id, kinopoisk_id -> id и хешей персон на весь импорт
+        self.countries, self.genres, self.people = {}, {}, {}
+        self.person_hashes = {}
+        self.force = options['force']
+        self.seen = set()
+        self.stats = Counter()
+        self.downloader = ImageDownloader(options['workers'])
+        self.create_films(options['file'], options['batch_size'])
+        self.remove_films(options['prune'])
+        invalidate_counts(Film)
+        invalidate_counts(Person)
+        invalidate(CATALOG_TAG)
+        print("Films: {added} added, {changed} changed, "
+              "{unchanged} unchanged, {removed} removed, "
+              "{missing} missing from the file, "
+              "{skipped} skipped".format_map(self.stats))
 
     @staticmethod
-    def get_image_by_url(url):
-        img_tmp = NamedTemporaryFile(delete=True)
-        try:
-            with urlopen(url) as uo:
-                assert uo.status == 200
-                img_tmp.write(uo.read())
-                img_tmp.flush()
-        except HTTPError:
-            return None
-        return File(img_tmp)
+    def person_attrs(data):
+        attrs = {"name": data['name'], "origin_name": data.get('enName'),
+                 "birthday": None, "source_hash": data['source_hash']}
+        birthday = data.get('birthday')
+        if birthday and not birthday.startswith("0000-"):
+            attrs['birthday'] = birthday[:10]
+        return attrs
 
-    def create_person(self, data):
-        print(f"Processing PERSON «{data['name']}»")
-        attrs = {"name": data['name'], "origin_name": data['enName']}
-        try:
-            if not data['birthday'].startswith("0000-"):
-                attrs['birthday'] = data['birthday'][:10]
-        except KeyError:
-            pass
-        try:
-            photo_url = data['photo']
-        except KeyError:
-            photo_url = None
-        person = Person.objects.update_or_create(kinopoisk_id=data['id'],
-                                                 defaults=attrs)[0]
-        if photo_url:
-            image_file = self.get_image_by_url(photo_url)
-            if image_file:
-                person.photo.save(os.path.basename(photo_url), image_file)
-        return person
-
-    def create_film(self, data):
-        print(f"Processing FILM «{data['name']}»")
-        country_name = data['countries'][0]['name']
-        country = Country.objects.update_or_create(name=country_name)[0]
-        genres = []
-        for genre_data in data['genres']:
-            genre_name = genre_data['name']
-            genre = Genre.objects.update_or_create(name=genre_name)[0]
-            genres.append(genre)
+    def parse_film(self, data):
+        self.seen.add(data['id'])
+        source_hash = fingerprint(data)
         director = None
-        people = []
+        people = {}
         for person_data in data['persons']:
             if not person_data['name']:
                 continue
+            person_data['source_hash'] = fingerprint(
+                {key: person_data.get(key) for key in PERSON_SOURCE})
             if person_data['profession'] == 'режиссеры' and director is None:
-                director = self.create_person(person_data)
+                director = person_data
             elif person_data['profession'] == 'актеры':
-                people.append(self.create_person(person_data))
+                people[person_data['id']] = person_data
+        if director is None or not data['countries']:
+            print(f"Skipping FILM «{data['name']}»: no director or country")
+            self.stats['skipped'] += 1
+            return None
         try:
-            cover_url = data['poster']['url']
-        except KeyError:
-            cover_url = None
-        attrs = {"name": data["name"], "origin_name": data["enName"],
-                 "slogan": data["slogan"], "length": data["movieLength"],
-                 "description": data["description"], "year": data["year"],
-                 "director": director, "country": country}
+            trailer_url = data['videos']['trailers'][0]['url']
+        except (KeyError, IndexError, TypeError):
+            trailer_url = None
+        return {
+            "kinopoisk_id": data['id'],
+            "country": data['countries'][0]['name'],
+            "genres": {genre['name'] for genre in data['genres']},
+            "director": director,
+            "people": list(people.values()),
+            "cover_url": (data.get('poster') or {}).get('url'),
+            "attrs": {"name": data["name"], "origin_name": data["enName"],
+                      "slogan": data["slogan"],
+                      "length": data["movieLength"],
+                      "description": data["description"],
+                      "year": data["year"], "trailer_url": trailer_url,
+                      "source_hash": source_hash},
+        }
+
+    @staticmethod
+    def resolve_names(model, names, cache):
+        missing = set(names) - cache.keys()
+        if missing:
+            # Страны и жанры не меняются, достаточно вставить новые
+            model.objects.bulk_create(
+                [model(name=name) for name in missing], ignore_conflicts=True)
+            cache.update(model.objects.filter(name__in=missing)
+                         .values_list('name', 'id'))
+
+    def upsert_people(self, people):
+        """Записывает новые и изменённые персоны, возвращает их kinopoisk_id"""
+        unknown = people.keys() - self.person_hashes.keys()
+        for kinopoisk_id, person_id, source_hash in Person.objects.filter(
+                kinopoisk_id__in=unknown).values_list(
+                    'kinopoisk_id', 'id', 'source_hash'):
+            self.people[kinopoisk_id] = person_id
+            self.person_hashes[kinopoisk_id] = source_hash
+        changed = {kinopoisk_id: data for kinopoisk_id, data in people.items()
+                   if self.force or data['source_hash']
+                   != self.person_hashes.get(kinopoisk_id)}
+        if changed:
+            Person.objects.bulk_create(
+                [Person(kinopoisk_id=kinopoisk_id, **self.person_attrs(data))
+                 for kinopoisk_id, data in changed.items()],
+                update_conflicts=True, unique_fields=['kinopoisk_id'],
+                update_fields=PERSON_FIELDS + ['updated_at'])
+            self.people.update(Person.objects.filter(
+                kinopoisk_id__in=changed.keys() - self.people.keys())
+                .values_list('kinopoisk_id', 'id'))
+            self.person_hashes.update(
+                (kinopoisk_id, data['source_hash'])
+                for kinopoisk_id, data in changed.items())
+        return changed.keys()
+
+    def upsert_films(self, films):
+        objs = [Film(kinopoisk_id=film['kinopoisk_id'],
+                     country_id=self.countries[film['country']],
+                     director_id=self.people[film['director']['id']],
+                     **film['attrs'])
+                for film in films]
+        Film.objects.bulk_create(
+            objs, update_conflicts=True, unique_fields=['kinopoisk_id'],
+            update_fields=FILM_FIELDS + ['updated_at'])
+        return dict(Film.objects.filter(
+            kinopoisk_id__in=[film['kinopoisk_id'] for film in films])
+            .values_list('kinopoisk_id', 'id'))
+
+    def changed_films(self, films):
+        hashes = dict(Film.objects.filter(
+            kinopoisk_id__in=[film['kinopoisk_id'] for film in films])
+            .values_list('kinopoisk_id', 'source_hash'))
+        changed = []
+        for film in films:
+            if film['kinopoisk_id'] not in hashes:
+                self.stats['added'] += 1
+            elif self.force or hashes[film['kinopoisk_id']] \
+                    != film['attrs']['source_hash']:
+                self.stats['changed'] += 1
+            else:
+                self.stats['unchanged'] += 1
+                continue
+            changed.append(film)
+        return changed
+
+    def import_batch(self, docs):
+        films = [film for film in map(self.parse_film, docs) if film]
+        if films:
+            films = self.changed_films(films)
+        if not films:
+            return []
+        people = {}
+        for film in films:
+            for person_data in [film['director']] + film['people']:
+                people[person_data['id']] = person_data
+        with transaction.atomic():
+            self.resolve_names(Country, {film['country'] for film in films},
+                               self.countries)
+            self.resolve_names(Genre, set().union(
+                *(film['genres'] for film in films)), self.genres)
+            changed_people = self.upsert_people(people)
+            old_cast = graph.film_cast(Film.objects.filter(
+                kinopoisk_id__in=[film['kinopoisk_id'] for film in films]))
+            film_ids = self.upsert_films(films)
+            ids = film_ids.values()
+            Film.genres.through.objects.filter(film_id__in=ids).delete()
+            Film.genres.through.objects.bulk_create([
+                Film.genres.through(film_id=film_ids[film['kinopoisk_id']],
+                                    genre_id=self.genres[name])
+                for film in films for name in film['genres']])
+            Film.people.through.objects.filter(film_id__in=ids).delete()
+            Film.people.through.objects.bulk_create([
+                Film.people.through(film_id=film_ids[film['kinopoisk_id']],
+                                    person_id=self.people[data['id']])
+                for film in films for data in film['people']])
+            self.update_graph(films, film_ids, old_cast)
+        images = [(Film, film_ids[film['kinopoisk_id']], 'cover',
+                   film['cover_url'])
+                  for film in films if film['cover_url']]
+        images += [(Person, self.people[kinopoisk_id], 'photo',
+                    people[kinopoisk_id]['photo'])
+                   for kinopoisk_id in changed_people
+                   if people[kinopoisk_id].get('photo')]
+        return images
+
+    def update_graph(self, films, film_ids, old_cast):
+        # Сигналы при массовой записи не срабатывают, рёбра графа
+        # совместной работы обновляем сами
+        changes = []
+        for film in films:
+            director, actors = old_cast.get(
+                film_ids[film['kinopoisk_id']], (None, set()))
+            changes.append((actors | {director}, {
+                self.people[data['id']]
+                for data in [film['director']] + film['people']}))
+        graph.update(changes)
+
+    def save_images(self, images):
+        names = self.downloader.download({
+            url: model._meta.get_field(field).upload_to
+            for model, obj_id, field, url in images})
+        updates = defaultdict(list)
+        for model, obj_id, field, url in images:
+            if names[url]:
+                updates[model, field].append(
+                    model(id=obj_id, **{field: names[url]}))
+        for (model, field), objs in updates.items():
+            model.objects.bulk_update(objs, [field])
+
+    def create_films(self, filename, batch_size):
+        films_data = iter_docs(filename)
+        total = 0
         try:
-            attrs["trailer_url"] = data['videos']['trailers'][0]['url']
-        except (KeyError, IndexError):
-            pass
-
-        film = Film.objects.update_or_create(kinopoisk_id=data['id'],
-                                             defaults=attrs)[0]
-        film.people.set(people)
-        film.genres.set(genres)
-
-        if cover_url:
-            image_file = self.get_image_by_url(cover_url)
-            if image_file:
-                film.cover.save(os.path.basename(cover_url), image_file)
-
-        return film
-
-    def create_films(self):
-        with open(GetCommand.filename(), 'r') as f:
-            films_data = json.load(f)
-            for film_data in films_data['docs']:
-                self.create_film(film_data)
+            while docs := list(islice(films_data, batch_size)):
+                # Картинки качаются после коммита пачки, вне транзакции
+                self.save_images(self.import_batch(docs))
+                total += len(docs)
+                print(f"FILM {total}")
+        except (OSError, ValueError) as e:
+            raise CommandError(f'{filename}: {e}')
+
+    def remove_films(self, prune):
+        removed = set(Film.objects.filter(kinopoisk_id__isnull=False)
+                      .values_list('kinopoisk_id', flat=True)
+                      .iterator()) - self.seen
+        # Без --prune фильмы остаются, о них только сообщаем
+        self.stats['removed' if prune else 'missing'] = len(removed)
+        if prune and removed:
+            removed = sorted(removed)
+            for start in range(0, len(removed), PRUNE_CHUNK):
+                Film.objects.filter(kinopoisk_id__in=removed[
+                    start:start + PRUNE_CHUNK]).delete()
@@ -0,0 +1,96 @@
+import json
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from films.cache import CATALOG_TAG, invalidate
+from films.helpers import insert_rows, invalidate_counts
+from films.models import Film, Person
+from films.readers import open_dump
+from news.counters import reconcile
+from news.models import News
+from .export_snapshot import MODELS, snapshot_models
+
+
+class Command(BaseCommand):
+    help = 'Bulk load a snapshot written by export_snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', default='snapshot.ndjson.gz')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete existing rows first')
+
+    def handle(self, *args, **options):
+        models = snapshot_models()
+        # Одна транзакция: внешние ключи проверяются при коммите, поэтому
+        # порядок строк (например, ответов на комментарии) не важен
+        with transaction.atomic():
+            self.prepare(models, options['flush'])
+            try:
+                with open_dump(options['input']) as f:
+                    self.load(f, options['batch_size'])
+            except (OSError, ValueError, LookupError) as e:
+                raise CommandError(f"{options['input']}: {e}")
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(),
+                                                             models):
+                    cursor.execute(sql)
+            # В старых снимках счётчиков реакций и комментариев ещё нет
+            reconcile()
+        invalidate_counts(Film)
+        invalidate_counts(Person)
+        invalidate_counts(News)
+        invalidate(CATALOG_TAG)
+
+    @staticmethod
+    def prepare(models, flush):
+        filled = [model._meta.label for model in models
+                  if model._base_manager.exists()]
+        if not filled:
+            return
+        if not flush:
+            raise CommandError(f"Not empty: {', '.join(filled)}. "
+                               f"Use --flush to replace existing data")
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for model in reversed(models):
+                if model is get_user_model():
+                    # На пользователей ссылаются таблицы вне снимка
+                    # (журнал админки, группы), удаляем через ORM
+                    model._base_manager.all().delete()
+                else:
+                    cursor.execute(f'DELETE FROM {qn(model._meta.db_table)}')
+
+    @staticmethod
+    def converters(model, fields):
+        def convert(field):
+            return lambda value: None if value is None else \
+                field.get_db_prep_save(field.to_python(value), connection)
+        return [convert(model._meta.get_field(name)) for name in fields]
+
+    def load(self, f, batch_size):
+        model, fields, rows, total = None, None, [], 0
+        for line in f:
+            data = json.loads(line)
+            if isinstance(data, dict):
+                if model:
+                    insert_rows(model, fields, rows)
+                    print(f'{model._meta.label} {total}')
+                if data['model'] not in MODELS:
+                    raise ValueError(f"unexpected model {data['model']}")
+                model = apps.get_model(data['model'])
+                fields = data['fields']
+                converters = self.converters(model, fields)
+                rows, total = [], 0
+                continue
+            rows.append([convert(value)
+                         for convert, value in zip(converters, data)])
+            total += 1
+            if len(rows) >= batch_size:
+                insert_rows(model, fields, rows)
+                rows = []
+        if model:
+            insert_rows(model, fields, rows)
+            print(f'{model._meta.label} {total}')
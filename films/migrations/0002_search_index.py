@@ -0,0 +1,71 @@
+from django.db import migrations
+
+TABLES = {
+    'films_film': ('name', 'origin_name', 'slogan', 'description'),
+    'films_person': ('name', 'origin_name'),
+}
+
+
+def create_triggers(schema_editor):
+    # SQLite удаляет триггеры при пересоздании таблицы (AlterField и
+    # т.п.), поэтому такие миграции вызывают эту функцию повторно
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, columns in TABLES.items():
+        fts = f'{table}_fts'
+        names = ', '.join(columns)
+        new = ', '.join(f'new.{column}' for column in columns)
+        old = ', '.join(f'old.{column}' for column in columns)
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} '
+            f'BEGIN '
+            f'INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); '
+            f'END')
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} '
+            f'BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {names}) "
+            f"VALUES ('delete', old.id, {old}); "
+            f'END')
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_au '
+            f'AFTER UPDATE OF {names} ON {table} '
+            f'BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {names}) "
+            f"VALUES ('delete', old.id, {old}); "
+            f'INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); '
+            f'END')
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, columns in TABLES.items():
+        fts = f'{table}_fts'
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({', '.join(columns)}, "
+            f"content='{table}', content_rowid='id', "
+            f"tokenize='porter unicode61 remove_diacritics 2')")
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    create_triggers(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES:
+        fts = f'{table}_fts'
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:33
+
+from importlib import import_module
+from django.db import migrations, models
+
+search_index = import_module('films.migrations.0002_search_index')
+
+
+def create_triggers(apps, schema_editor):
+    search_index.create_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0003_film_person_name_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='film',
+            name='kinopoisk_id',
+            field=models.PositiveIntegerField(blank=True, null=True, unique=True, verbose_name='Kinopoisk ID'),
+        ),
+        migrations.AlterField(
+            model_name='person',
+            name='kinopoisk_id',
+            field=models.PositiveIntegerField(blank=True, null=True, unique=True, verbose_name='Kinopoisk ID'),
+        ),
+        # Пересоздание таблиц удалило триггеры поискового индекса
+        migrations.RunPython(create_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0004_kinopoisk_id_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='film',
+            name='source_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Хеш источника'),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='source_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Хеш источника'),
+        ),
+    ]
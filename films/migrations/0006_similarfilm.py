@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0005_source_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarFilm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('film', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_films', to='films.film', verbose_name='Фильм')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='films.film', verbose_name='Похожий фильм')),
+            ],
+            options={
+                'verbose_name': 'Похожий фильм',
+                'verbose_name_plural': 'Похожие фильмы',
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['film', '-score'], name='films_simil_film_id_5192db_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0006_similarfilm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Collaboration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('films', models.PositiveIntegerField(verbose_name='Общих фильмов')),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='films.person', verbose_name='Коллега')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='collaborations', to='films.person', verbose_name='Персона')),
+            ],
+            options={
+                'verbose_name': 'Совместная работа',
+                'verbose_name_plural': 'Совместные работы',
+                'ordering': ['-films'],
+                'indexes': [models.Index(fields=['person', '-films'], name='films_colla_person__807753_idx')],
+                'constraints': [models.UniqueConstraint(fields=('person', 'partner'), name='unique_collaboration')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0008_person_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('url', models.CharField(max_length=1000, unique=True, verbose_name='URL')),
+                ('name', models.CharField(max_length=255, verbose_name='Файл')),
+            ],
+            options={
+                'verbose_name': 'Источник картинки',
+                'verbose_name_plural': 'Источники картинок',
+            },
+        ),
+    ]
@@ -47,7 +47,10 @@ class Person(MyModel):
     photo = models.ImageField(
         "Фото", upload_to='photos/', blank=True, null=True)
     kinopoisk_id = models.PositiveIntegerField(
-        "Kinopoisk ID", blank=True, null=True)
+        "Kinopoisk ID", blank=True, null=True, unique=True)
+    # Хеш исходных данных импорта, неизменённые записи не перезаписываются
+    source_hash = models.CharField(
+        "Хеш источника", max_length=64, blank=True, null=True, editable=False)
 
     def age(self):
         if not self.birthday:
@@ -59,6 +62,9 @@ class Person(MyModel):
 
     class Meta:
         ordering = ["name"]
+        # updated_at — догрузка изменений в индекс автодополнения
+        indexes = [models.Index(fields=["name", "id"]),
+                   models.Index(fields=["updated_at"])]
         verbose_name = "Персона"
         verbose_name_plural = "Персоны"
 
@@ -88,12 +94,72 @@ class Film(MyModel):
     description = models.TextField("Описание", blank=True, null=True)
     people = models.ManyToManyField(Person, verbose_name="Актеры")
     kinopoisk_id = models.PositiveIntegerField(
-        "Kinopoisk ID", blank=True, null=True)
+        "Kinopoisk ID", blank=True, null=True, unique=True)
+    # Хеш исходных данных импорта, неизменённые записи не перезаписываются
+    source_hash = models.CharField(
+        "Хеш источника", max_length=64, blank=True, null=True, editable=False)
 
     class Meta:
         ordering = ["name"]
+        indexes = [models.Index(fields=["name", "id"])]
         verbose_name = "Фильм"
         verbose_name_plural = "Фильмы"
 
     def __str__(self):
         return self.name
+
+
+class SimilarFilm(MyModel):
+    # Строится командой build_similar, на странице фильма только читается
+    film = models.ForeignKey(
+        Film, on_delete=models.CASCADE, related_name="similar_films",
+        verbose_name="Фильм")
+    similar = models.ForeignKey(
+        Film, on_delete=models.CASCADE, related_name="+",
+        verbose_name="Похожий фильм")
+    score = models.FloatField("Сходство")
+
+    class Meta:
+        ordering = ["-score"]
+        indexes = [models.Index(fields=["film", "-score"])]
+        verbose_name = "Похожий фильм"
+        verbose_name_plural = "Похожие фильмы"
+
+    def __str__(self):
+        return f"{self.film} → {self.similar}"
+
+
+class Collaboration(MyModel):
+    # Ребро графа совместной работы (актёры и режиссёр одного фильма),
+    # хранится в обе стороны. Поддерживается films.graph.
+    person = models.ForeignKey(
+        Person, on_delete=models.CASCADE, related_name="collaborations",
+        verbose_name="Персона")
+    partner = models.ForeignKey(
+        Person, on_delete=models.CASCADE, related_name="+",
+        verbose_name="Коллега")
+    films = models.PositiveIntegerField("Общих фильмов")
+
+    class Meta:
+        ordering = ["-films"]
+        constraints = [models.UniqueConstraint(
+            fields=["person", "partner"], name="unique_collaboration")]
+        indexes = [models.Index(fields=["person", "-films"])]
+        verbose_name = "Совместная работа"
+        verbose_name_plural = "Совместные работы"
+
+    def __str__(self):
+        return f"{self.person} — {self.partner}"
+
+
+class ImageSource(MyModel):
+    # Откуда скачан файл картинки: повторный импорт не качает его снова
+    url = models.CharField("URL", max_length=1000, unique=True)
+    name = models.CharField("Файл", max_length=255)
+
+    class Meta:
+        verbose_name = "Источник картинки"
+        verbose_name_plural = "Источники картинок"
+
+    def __str__(self):
+        return self.url
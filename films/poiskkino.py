@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+import requests
+
+BASE_URL = 'https://api.poiskkino.dev'
+PAGE_SIZE = 250
+TIMEOUT = 30
+
+
+class APIError(Exception):
+    pass
+
+
+class RateLimiter:
+    # Не больше rate запросов в секунду на все потоки
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class PoiskKino:
+    # Клиент api.poiskkino.dev: общий лимит запросов, повтор с
+    # экспоненциальной задержкой на 429/5xx и сетевые ошибки
+    def __init__(self, base_url=BASE_URL, rate=5, retries=5, backoff=1.0):
+        self.base_url = base_url.rstrip('/')
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.local = threading.local()
+
+    @staticmethod
+    def headers():
+        return {"X-API-KEY": os.environ.get("POISKKINO_DEV_TOKEN")}
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.headers())
+        return self.local.session
+
+    def get(self, path, params):
+        url = self.base_url + path
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            delay = self.backoff * 2 ** attempt
+            try:
+                response = self.session().get(url, params=params,
+                                              timeout=TIMEOUT)
+            except requests.RequestException as e:
+                error = e
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                error = f'HTTP {response.status_code}'
+                if response.status_code != 429 \
+                        and response.status_code < 500:
+                    raise APIError(f'{url} page {params.get("page")}: '
+                                   f'{error}')
+                try:
+                    delay = max(delay,
+                                float(response.headers['Retry-After']))
+                except (KeyError, ValueError):
+                    pass
+            if attempt < self.retries:
+                print(f'Retry {url} page {params.get("page")} '
+                      f'in {delay:.1f}s: {error}')
+                time.sleep(delay)
+        raise APIError(f'{url} page {params.get("page")}: {error}, '
+                       f'gave up after {self.retries + 1} attempts')
+
+    def movies(self, params, page):
+        return self.get('/v1.4/movie',
+                        {**params, 'limit': PAGE_SIZE, 'page': page})
+
+    def birthdays(self, movie_ids):
+        res = {}
+        params = {
+            "selectFields": ["id", "birthday"],
+            "notNullFields": ["birthday"],
+            "limit": PAGE_SIZE,
+            "movies.id": sorted(movie_ids),
+            "page": 1
+        }
+        while True:
+            data = self.get('/v1.4/person', params)
+            for person in data['docs']:
+                res[person['id']] = person['birthday']
+            if params["page"] >= data['pages']:
+                return res
+            params["page"] += 1
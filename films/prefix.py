@@ -0,0 +1,155 @@
+import datetime
+import threading
+from array import array
+from bisect import bisect_left
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce, Length
+from django.utils import timezone
+from .cache import CATALOG_TAG, versions
+from .models import Country, Person
+
+# Индекс префиксов для автодополнения: ключи — начала каждого слова
+# названия в нижнем регистре и с «ё» → «е», отсортированные и склеенные
+# в одну строку байт (UTF-8 сохраняет порядок), плюс массивы смещений и
+# id. Изменённые после построения записи догружаются в небольшой
+# дополнительный список, удалённые отсеиваются выборкой по id.
+LIMIT = 100
+# Больше этого индекс не строится, поиск идёт в БД
+MEMORY_LIMIT = 256 * 2 ** 20
+# Пик памяти сборки на ключ сверх его байтов (они лежат дважды: в объекте
+# bytes и в склеенной строке): кортеж, bytes, ссылки в списках, offsets
+# и ids. Измерено tracemalloc на 800 тыс. ключах.
+ENTRY_SIZE = 200
+# Дополнительный список больше этого — перестраиваем индекс целиком
+OVERLAY_LIMIT = 50000
+# Запись могла получить updated_at до построения, а закоммититься после
+WATERMARK_LAG = datetime.timedelta(minutes=5)
+FIELDS = {Person: ['name', 'origin_name'], Country: ['name']}
+
+
+def fold(text):
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def index_tag(model):
+    return f'prefix:{model._meta.label_lower}'
+
+
+def keys(*names):
+    """Ключи записи: название с начала каждого слова"""
+    result = set()
+    for name in names:
+        if name:
+            name = fold(name)
+            result.add(name)
+            result.update(name[i + 1:] for i, char in enumerate(name)
+                          if char == ' ')
+    return [key.encode() for key in result]
+
+
+class PrefixIndex:
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.version = None
+        # (blob, offsets, ids, overlay, overlay_ids) или None. Заменяется
+        # целиком, поэтому поиск читает его без блокировки
+        self.data = None
+
+    def rows(self, queryset):
+        fields = FIELDS[self.model]
+        return queryset.values_list('id', *fields).iterator()
+
+    def too_large(self):
+        # Нижняя оценка по БД: хотя бы по ключу на каждое название
+        totals = self.model.objects.aggregate(
+            names=sum((Count(field) for field in FIELDS[self.model]),
+                      Value(0)),
+            chars=sum((Coalesce(Sum(Length(field)), 0)
+                       for field in FIELDS[self.model]), Value(0)))
+        return totals['names'] * ENTRY_SIZE + totals['chars'] > MEMORY_LIMIT
+
+    def build(self):
+        # Пока идёт сборка, поиск работает по прежним данным
+        self.watermark = timezone.now() - WATERMARK_LAG
+        if self.too_large():
+            self.data = None
+            return
+        entries, size = [], 0
+        for pk, *names in self.rows(self.model.objects.all()):
+            for key in keys(*names):
+                entries.append((key, pk))
+                size += len(key) * 2 + ENTRY_SIZE
+            if size > MEMORY_LIMIT:
+                self.data = None
+                return
+        entries.sort()
+        offsets = array('Q', [0])
+        for key, pk in entries:
+            offsets.append(offsets[-1] + len(key))
+        blob = b''.join(key for key, pk in entries)
+        ids = array('q', (pk for key, pk in entries))
+        self.data = (blob, offsets, ids, [], set())
+
+    def refresh(self):
+        # Записи, изменённые после построения, заменяют свои старые ключи
+        changed = list(self.rows(self.model.objects.filter(
+            updated_at__gt=self.watermark)))
+        if len(changed) > OVERLAY_LIMIT:
+            self.build()
+            return
+        overlay = sorted((key, pk) for pk, *names in changed
+                         for key in keys(*names))
+        self.data = self.data[:3] + (overlay,
+                                     {pk for pk, *names in changed})
+
+    def ensure(self):
+        version = versions([CATALOG_TAG, index_tag(self.model)])
+        if version == self.version:
+            return
+        with self.lock:
+            if self.version is None or version[0] != self.version[0]:
+                self.build()
+            elif self.data is not None:
+                self.refresh()
+            self.version = version
+
+    def search(self, query, limit=LIMIT):
+        """id записей, у которых слово начинается с query, или None,
+        если индекс не поместился в MEMORY_LIMIT"""
+        self.ensure()
+        data = self.data
+        if data is None:
+            return None
+        blob, offsets, ids, overlay, overlay_ids = data
+
+        def key(i):
+            return blob[offsets[i]:offsets[i + 1]]
+
+        prefix = fold(query).encode()
+        found = []
+        i = bisect_left(range(len(ids)), prefix, key=key)
+        while i < len(ids) and len(found) < limit \
+                and key(i).startswith(prefix):
+            if ids[i] not in overlay_ids:
+                found.append(ids[i])
+            i += 1
+        i = bisect_left(overlay, (prefix,))
+        while i < len(overlay) and overlay[i][0].startswith(prefix):
+            found.append(overlay[i][1])
+            i += 1
+        return list(dict.fromkeys(found))[:limit]
+
+
+INDEXES = {model: PrefixIndex(model) for model in FIELDS}
+
+
+def complete(queryset, query):
+    """Записи queryset, у которых какое-то слово начинается с query"""
+    ids = INDEXES[queryset.model].search(query)
+    if ids is not None:
+        return queryset.filter(id__in=ids)
+    condition = Q()
+    for field in FIELDS[queryset.model]:
+        condition |= Q(**{f'{field}__istartswith': query})
+    return queryset.filter(condition)
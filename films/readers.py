@@ -0,0 +1,127 @@
+import gzip
+import io
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+WHITESPACE = ' \t\n\r'
+
+decoder = json.JSONDecoder()
+
+
+def open_dump(path):
+    """Открывает дамп как текст, gzip и zstd распознаются по сигнатуре"""
+    f = open(path, 'rb')
+    magic = f.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        f = gzip.GzipFile(fileobj=f)
+    elif magic == ZSTD_MAGIC:
+        if zstandard is None:
+            f.close()
+            raise ValueError(f'{path}: install zstandard to read .zst files')
+        f = zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+
+class JSONStream:
+    # Разбирает JSON по кускам: в памяти только текущий объект
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        # Пройдено переводов строк: NDJSON отличаем по ним
+        self.newlines = 0
+
+    def read(self, size=CHUNK_SIZE):
+        chunk = self.f.read(size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) \
+                    and self.buffer[self.pos] in WHITESPACE:
+                self.newlines += self.buffer[self.pos] == '\n'
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} in JSON dump')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Объект не поместился в буфер, читаем вдвое больше
+                if not self.read(max(CHUNK_SIZE,
+                                     len(self.buffer) - self.pos)):
+                    raise
+                continue
+            # Число на границе буфера могло продолжиться в следующем куске
+            if end == len(self.buffer) and self.read():
+                continue
+            self.newlines += self.buffer.count('\n', self.pos, end)
+            self.pos = end
+            return value
+
+    def items(self):
+        self.expect('[')
+        if self.peek() == ']':
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                return
+            self.expect(',')
+
+    def docs(self):
+        """Элементы верхнего массива, массива "docs" объекта или
+        объекты NDJSON подряд"""
+        if self.peek() == '[':
+            yield from self.items()
+            return
+        self.expect('{')
+        # Ключи разбираются по одному: объект с "docs" может быть весь
+        # дамп, и целиком его не читаем
+        doc, newlines = {}, self.newlines
+        while self.peek() != '}':
+            key = self.value()
+            self.expect(':')
+            if key == 'docs':
+                yield from self.items()
+                return
+            doc[key] = self.value()
+            if self.peek() == ',':
+                self.pos += 1
+        # Однострочный объект без "docs" — первый фильм NDJSON, дальше
+        # такие же
+        if self.newlines != newlines:
+            raise ValueError('No "docs" array in JSON dump')
+        self.pos += 1
+        yield doc
+        while self.peek():
+            yield self.value()
+
+
+def iter_docs(path):
+    """Фильмы из дампа по одному: JSON, NDJSON, в т.ч. сжатые gzip/zstd"""
+    # Формат определяется по разбору, а не по первой строке: строка NDJSON
+    # может быть любой длины
+    with open_dump(path) as f:
+        yield from JSONStream(f).docs()
@@ -0,0 +1,61 @@
+import re
+from django.db import connection
+from django.db.models import Case, When
+
+SEARCH_LIMIT = 500
+
+# Таблицы FTS5 и веса колонок для bm25(); создаются миграцией 0002
+INDEXES = {
+    'films.film': ('films_film_fts', ('name', 'origin_name', 'slogan',
+                                      'description'), (10.0, 5.0, 2.0, 1.0)),
+    'films.person': ('films_person_fts', ('name', 'origin_name'), (1.0, 1.0)),
+}
+
+TOKEN_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-яё]')
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых',
+    'их', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ей', 'ую', 'юю', 'ия', 'а',
+    'я', 'ы', 'и', 'о', 'е', 'у', 'ю', 'ь', 'й'), key=len, reverse=True)
+
+
+def stem(token):
+    # Английские слова стеммит токенизатор porter, для русских отрезаем
+    # окончание и ищем по префиксу, чтобы «матрицы» находило «Матрица»
+    if not CYRILLIC_RE.search(token):
+        return token
+    for ending in RUSSIAN_ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[:-len(ending)]
+    return token
+
+
+def match_expression(query):
+    tokens = TOKEN_RE.findall(query.lower())
+    return ' '.join(f'"{stem(token)}"*' for token in tokens)
+
+
+def ranked_ids(model, query, limit=SEARCH_LIMIT):
+    table, columns, weights = INDEXES[model._meta.label_lower]
+    expression = match_expression(query)
+    if not expression:
+        return []
+    weights = ', '.join(str(weight) for weight in weights)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+            f'ORDER BY bm25({table}, {weights}) LIMIT %s',
+            [expression, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(queryset, query):
+    if connection.vendor != 'sqlite':
+        return queryset.filter(name__icontains=query)
+    ids = ranked_ids(queryset.model, query)
+    if not ids:
+        return queryset.none()
+    ordering = Case(*[When(id=pk, then=position)
+                      for position, pk in enumerate(ids)])
+    return queryset.filter(id__in=ids).order_by(ordering)
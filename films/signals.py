@@ -0,0 +1,181 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from . import graph
+from .cache import FILM_PAGES_TAG, invalidate
+from .helpers import invalidate_counts
+from .prefix import index_tag
+from .models import Country, Film, Genre, Person, SimilarFilm
+
+# Теги страниц из cache_page: film:<id>, person:<id>, country:<id>,
+# genre:<id> — страницы объектов, films, countries, genres, people — списки.
+# Сбрасываются после коммита, иначе параллельный запрос успел бы
+# закешировать старые данные.
+THROUGH_TAGS = {Film.genres.through: 'genre', Film.people.through: 'person'}
+THROUGH_FIELDS = {Film.genres.through: 'genres',
+                  Film.people.through: 'people'}
+LIST_TAGS = {Country: 'countries', Genre: 'genres'}
+
+
+def invalidate_on_commit(*tags):
+    transaction.on_commit(lambda: invalidate(*tags))
+
+
+def touch_films(films):
+    # Фрагменты карточек и списков на странице фильма кешируются по
+    # updated_at фильма, поэтому изменение связанных объектов его обновляет.
+    # films — набор фильмов, обновляется одним UPDATE с подзапросом.
+    films.update(updated_at=timezone.now())
+
+
+def film_tags(film):
+    """Страницы, на которых показан фильм"""
+    tags = {f'film:{film.pk}', 'films', f'person:{film.director_id}',
+            f'country:{film.country_id}'}
+    tags.update(f'person:{pk}'
+                for pk in film.people.values_list('pk', flat=True))
+    tags.update(f'genre:{pk}'
+                for pk in film.genres.values_list('pk', flat=True))
+    # Фильмы, у которых он в списке похожих
+    tags.update(f'film:{pk}' for pk in SimilarFilm.objects.filter(
+        similar=film.pk).values_list('film', flat=True))
+    return tags
+
+
+def cast_changed(changes):
+    # Рёбра графа меняются в той же транзакции, что и состав фильма
+    people = graph.update(changes)
+    invalidate_on_commit(*(f'person:{pk}' for pk in people))
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_delete, sender=Film)
+@receiver(m2m_changed, sender=Film.genres.through)
+def film_changed(sender, action='post', **kwargs):
+    if action.startswith('pre_'):
+        return
+    # Смена страны или жанров тоже меняет состав списков, поэтому
+    # сбрасываем счётчики при любом изменении фильма
+    invalidate_counts(Film)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def person_count_changed(sender, **kwargs):
+    invalidate_counts(Person)
+
+
+@receiver(pre_save, sender=Film)
+def film_pre_save(sender, instance, **kwargs):
+    instance._old = Film.objects.filter(pk=instance.pk) \
+        .values_list('director_id', 'country_id').first()
+
+
+@receiver(post_save, sender=Film)
+@receiver(pre_delete, sender=Film)
+def film_pages_changed(sender, instance, signal, **kwargs):
+    tags = film_tags(instance)
+    old = getattr(instance, '_old', None)
+    # В списках стран и жанров показано число фильмов
+    if signal is pre_delete:
+        tags.update(LIST_TAGS.values())
+    elif old is None or old[1] != instance.country_id:
+        tags.add(LIST_TAGS[Country])
+    if old:
+        # Страницы прежних режиссёра и страны тоже надо сбросить
+        tags.update({f'person:{old[0]}', f'country:{old[1]}'})
+    invalidate_on_commit(*tags)
+
+
+@receiver(post_save, sender=Film)
+def film_director_changed(sender, instance, created, **kwargs):
+    old = getattr(instance, '_old', None)
+    old = old and old[0]
+    if old == instance.director_id:
+        return
+    director, actors = graph.film_cast([instance.pk])[instance.pk]
+    cast_changed([(set() if created else actors | {old},
+                   actors | {director})])
+
+
+@receiver(pre_delete, sender=Film)
+def film_cast_deleted(sender, instance, **kwargs):
+    cast_changed([(actors | {director}, set()) for director, actors in
+                  graph.film_cast([instance.pk]).values()])
+
+
+@receiver(m2m_changed, sender=Film.genres.through)
+@receiver(m2m_changed, sender=Film.people.through)
+def film_relations_changed(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    prefix = THROUGH_TAGS[sender]
+    if reverse:
+        # Фильмов у жанра или персоны может быть очень много: берём их
+        # подзапросом, страницы сбрасываем общим тегом
+        films = Film.objects.filter(pk__in=pk_set) if pk_set is not None \
+            else Film.objects.filter(**{THROUGH_FIELDS[sender]: instance.pk})
+        related, pages = [instance.pk], [FILM_PAGES_TAG]
+    else:
+        if action == 'pre_clear':
+            # После clear pk_set пуст, связи берём до удаления
+            pk_set = sender.objects.filter(film_id=instance.pk) \
+                .values_list(f'{prefix}_id', flat=True)
+        films = Film.objects.filter(pk=instance.pk)
+        related, pages = pk_set, [f'film:{instance.pk}']
+    touch_films(films)
+    invalidate_on_commit(*pages,
+                         *(f'{prefix}:{pk}' for pk in related),
+                         *([LIST_TAGS[Genre]]
+                           if sender is Film.genres.through else []))
+    if sender is Film.people.through:
+        people_changed(action, films, set(related))
+
+
+def people_changed(action, films, changed):
+    # Составы фильмов до и после изменения актёров changed
+    changes = []
+    for director, actors in graph.film_cast(films).values():
+        if action == 'pre_clear':
+            before, after = actors, actors - changed
+        elif action == 'post_add':
+            before, after = actors - changed, actors
+        else:
+            before, after = actors | changed, actors
+        changes.append((before | {director}, after | {director}))
+    cast_changed(changes)
+
+
+@receiver(post_save, sender=Person)
+@receiver(pre_delete, sender=Person)
+def person_changed(sender, instance, **kwargs):
+    touch_films(Film.objects.filter(Q(director=instance) |
+                                    Q(people=instance)))
+    # Страницы коллег показывают её в «Часто работает с». Рёбра графа
+    # хранятся в обе стороны, коллеги — партнёры самой персоны
+    partners = instance.collaborations.values_list('partner', flat=True)
+    invalidate_on_commit(f'person:{instance.pk}', 'people', FILM_PAGES_TAG,
+                         *(f'person:{pk}' for pk in partners))
+
+
+@receiver(post_save, sender=Country)
+@receiver(pre_delete, sender=Country)
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def named_changed(sender, instance, **kwargs):
+    name = sender._meta.model_name
+    touch_films(instance.film_set.all())
+    invalidate_on_commit(f'{name}:{instance.pk}', LIST_TAGS[sender],
+                         FILM_PAGES_TAG)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Country)
+def names_changed(sender, **kwargs):
+    # Индекс автодополнения догрузит изменённые записи, удалённые
+    # отсеиваются при выборке по id
+    invalidate_on_commit(index_tag(sender))
@@ -0,0 +1,120 @@
+import numpy as np
+from scipy import sparse
+from django.db.models import Count, Min
+from .models import Film, SimilarFilm
+
+# Сходство двух фильмов: взвешенная сумма косинусов по жанрам и по людям
+# (актёры и режиссёр, редкие совпадения весят больше, как в tf-idf),
+# умноженная на близость годов выпуска
+TOP_K = 12
+GENRE_WEIGHT = 0.4
+PEOPLE_WEIGHT = 0.6
+DIRECTOR_WEIGHT = 2.0
+YEAR_SCALE = 10.0
+# Строк матрицы сходства в памяти одновременно: CHUNK x число фильмов
+CHUNK = 256
+
+
+def pairs(queryset):
+    return np.array(list(queryset.iterator()), dtype=np.int64).reshape(-1, 2)
+
+
+def features(rows, columns, weights, shape_rows):
+    """Строки — фильмы, столбцы — признаки с весом idf, нормированные"""
+    columns, index = np.unique(columns, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (weights.astype(np.float32), (rows, index)),
+        shape=(shape_rows, len(columns)))
+    matrix.sum_duplicates()
+    df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((shape_rows + 1) / (df + 1)).astype(np.float32) + 1
+    matrix = matrix @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)))
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms.ravel()) @ matrix)
+
+
+class SimilarityIndex:
+    def __init__(self, top=TOP_K):
+        self.top = top
+        films = list(Film.objects.order_by('id')
+                     .values_list('id', 'year', 'director_id').iterator())
+        self.ids = np.array([film[0] for film in films], dtype=np.int64)
+        self.years = np.array(
+            [np.nan if film[1] is None else film[1] for film in films],
+            dtype=np.float32)
+        directors = np.array([film[2] for film in films], dtype=np.int64)
+
+        genres = pairs(Film.genres.through.objects
+                       .values_list('film_id', 'genre_id'))
+        # Жанров немного, плотная матрица умножается быстрее
+        self.genres = features(
+            self.index(genres[:, 0]), genres[:, 1],
+            np.ones(len(genres)), len(self.ids)).toarray()
+
+        people = pairs(Film.people.through.objects
+                       .values_list('film_id', 'person_id'))
+        # Режиссёр и актёр — разные признаки одной персоны
+        self.people = features(
+            np.concatenate([self.index(people[:, 0]),
+                            np.arange(len(self.ids))]),
+            np.concatenate([people[:, 1] * 2, directors * 2 + 1]),
+            np.concatenate([np.ones(len(people)),
+                            np.full(len(self.ids), DIRECTOR_WEIGHT)]),
+            len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, film_ids):
+        return np.searchsorted(self.ids, film_ids)
+
+    def scores(self, rows):
+        """Сходство фильмов с индексами rows со всеми фильмами"""
+        scores = GENRE_WEIGHT * (self.genres[rows] @ self.genres.T)
+        scores += PEOPLE_WEIGHT * (self.people[rows] @ self.people.T) \
+            .toarray()
+        distance = np.abs(self.years[rows, None] - self.years[None, :])
+        distance[np.isnan(distance)] = YEAR_SCALE
+        scores /= 1 + distance / YEAR_SCALE
+        scores[np.arange(len(rows)), rows] = 0
+        return scores
+
+    def neighbours(self, rows):
+        """(id фильма, [(id похожего, сходство), ...]) для строк rows"""
+        k = min(self.top, len(self) - 1)
+        for start in range(0, len(rows), CHUNK):
+            chunk = rows[start:start + CHUNK]
+            if k < 1:
+                yield from ((self.ids[row], []) for row in chunk)
+                continue
+            scores = self.scores(chunk)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            values = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-values, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            values = np.take_along_axis(values, order, axis=1)
+            for row, similar, score in zip(chunk, top, values):
+                yield self.ids[row], [
+                    (int(self.ids[column]), float(value))
+                    for column, value in zip(similar, score) if value > 0]
+
+    def affected(self, changed_ids):
+        """Фильмы, чьи списки могут измениться после правки changed_ids"""
+        changed = self.index(np.intersect1d(changed_ids, self.ids))
+        rows = set(changed.tolist())
+        rows.update(self.index(np.intersect1d(
+            list(SimilarFilm.objects.filter(similar__in=changed_ids)
+                 .order_by().values_list('film_id', flat=True).distinct()),
+            self.ids)).tolist())
+        current = {film_id: (score, count) for film_id, score, count in
+                   SimilarFilm.objects.order_by().values('film').annotate(
+                       Min('score'), Count('id')).values_list(
+                       'film', 'score__min', 'id__count').iterator()}
+        for start in range(0, len(changed), CHUNK):
+            best = self.scores(changed[start:start + CHUNK]).max(axis=0)
+            for row in np.flatnonzero(best > 0):
+                score, count = current.get(int(self.ids[row]), (0, 0))
+                if count < self.top or best[row] > score:
+                    rows.add(int(row))
+        return np.array(sorted(rows), dtype=np.int64)
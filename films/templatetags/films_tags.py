@@ -33,3 +33,44 @@ def ru_plural(value, variants):
     else:
         variant = 2
     return variants[variant]
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor=None):
+    params = context['request'].GET.copy()
+    params.pop('page', None)
+    params.pop('cursor', None)
+    if cursor:
+        params['cursor'] = cursor
+    return f'?{params.urlencode()}'
+
+
+@register.simple_tag(takes_context=True)
+def facet_url(context, name, value):
+    """Ссылка, которая включает или снимает опцию фасета"""
+    params = context['request'].GET.copy()
+    params.pop('page', None)
+    params.pop('cursor', None)
+    if name == 'genre':
+        values = params.getlist(name)
+        value = str(value)
+        params.setlist(name, [item for item in values if item != value]
+                       if value in values else values + [value])
+    elif isinstance(value, tuple):
+        keys = [f'{name}_from', f'{name}_to']
+        values = ['' if item is None else str(item) for item in value]
+        selected = [params.pop(key, [''])[-1] for key in keys] == values
+        if not selected:
+            for key, item in zip(keys, values):
+                if item:
+                    params[key] = item
+    else:
+        selected = params.pop(name, [''])[-1] == str(value)
+        if not selected:
+            params[name] = value
+    return f'?{params.urlencode()}'
+
+
+@register.filter
+def thousands(value):
+    return f'{value:,}'.replace(',', '\N{NO-BREAK SPACE}')
@@ -1,3 +1,1008 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import tracemalloc
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from filmbase.testing import QueryBudgetMixin, get
+from .management.commands import benchmark_views
+from .management.commands.import_films import Command as ImportCommand
+from . import facets, graph
+from .facets import facet_index, filter_films, parse_filters
+from .helpers import encode_cursor
+from .models import (Collaboration, Country, Film, Genre, Person,
+                     SimilarFilm)
+from .prefix import INDEXES, complete
+from .search import search
+from .readers import JSONStream, iter_docs, zstandard
 
-# Create your tests here.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class CatalogTestData:
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='admin')
+        cls.country = Country.objects.create(name='США')
+        cls.genres = [Genre.objects.create(name=name)
+                      for name in ('Драма', 'Комедия', 'Фантастика')]
+        cls.people = [Person.objects.create(name=f'Актёр {i}',
+                                            origin_name=f'Actor {i}')
+                      for i in range(10)]
+        cls.director = Person.objects.create(name='Режиссёр')
+        cls.films = []
+        for i in range(15):
+            film = Film.objects.create(
+                name=f'Фильм {i}', origin_name=f'Film {i}',
+                country=cls.country, director=cls.director, year=1990 + i,
+                description='Описание фильма')
+            film.genres.set(cls.genres[:i % 3 + 1])
+            film.people.set(cls.people[:i % 10 + 1])
+            cls.films.append(film)
+        cls.film = cls.films[-1]
+        cls.person = cls.people[0]
+        cls.genre = cls.genres[0]
+
+
+class FilmsQueryBudgetTest(CatalogTestData, QueryBudgetMixin, TestCase):
+    urls_module = 'films.urls'
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def routes(self):
+        country, genre = {'id': self.country.id}, {'id': self.genre.id}
+        film, person = {'id': self.film.id}, {'id': self.person.id}
+        return {
+            'films:home': get(8),
+            'films:film_list': get(8),
+            'films:film_detail': get(6, **film),
+            'films:film_create': get(3),
+            'films:film_update': get(9, **film),
+            'films:film_delete': get(3, **film),
+            'films:country_list': get(3),
+            'films:country_detail': get(5, **country),
+            'films:country_create': get(2),
+            'films:country_update': get(3, **country),
+            'films:country_delete': get(3, **country),
+            'films:country_autocomplete': get(2),
+            'films:genre_list': get(3),
+            'films:genre_detail': get(5, **genre),
+            'films:genre_create': get(2),
+            'films:genre_update': get(3, **genre),
+            'films:genre_delete': get(3, **genre),
+            'films:person_list': get(4),
+            'films:person_detail': get(6, **person),
+            'films:person_path': get(3),
+            'films:person_create': get(2),
+            'films:person_update': get(3, **person),
+            'films:person_delete': get(3, **person),
+            'films:person_autocomplete': get(2),
+        }
+
+    def test_search_query_budget(self):
+        # Индекс фасетов строится один раз на процесс
+        facet_index()
+        with self.assertNumQueries(6):
+            self.client.get('/films/', {'query': 'фильм'})
+
+    def test_query_stats_headers(self):
+        facet_index()
+        response = self.client.get('/films/')
+        self.assertEqual(int(response['X-DB-Queries']), 4)
+        self.assertIn('X-DB-Time', response)
+
+
+class PageCacheTest(CatalogTestData, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def assertCached(self, url, cached=True):
+        response = self.client.get(url)
+        self.assertEqual(response.get('X-Page-Cache'),
+                         'hit' if cached else 'miss', url)
+        return response
+
+    def change(self, action):
+        with self.captureOnCommitCallbacks(execute=True):
+            action()
+
+    def test_anonymous_pages_are_cached(self):
+        url = f'/films/{self.film.id}/'
+        self.assertCached(url, False)
+        # ETag собирается из версий тегов, запросов к БД нет
+        with self.assertNumQueries(0):
+            self.assertCached(url)
+        self.client.force_login(self.admin)
+        self.assertNotIn('X-Page-Cache', self.client.get(url))
+
+    def test_film_change_purges_related_pages(self):
+        other = self.films[0]
+        film_pages = [f'/films/{self.film.id}/', '/films/',
+                      f'/people/{self.director.id}/',
+                      f'/people/{self.person.id}/',
+                      f'/countries/{self.country.id}/',
+                      f'/genres/{self.genre.id}/']
+        unrelated = [f'/films/{other.id}/', '/countries/', '/genres/',
+                     f'/people/{self.people[-1].id}/']
+        for url in film_pages + unrelated:
+            self.assertCached(url, False)
+
+        self.film.name = 'Новое название'
+        self.change(self.film.save)
+        for url in film_pages:
+            self.assertContains(self.assertCached(url, False),
+                                'Новое название')
+        for url in unrelated:
+            self.assertCached(url)
+
+    def test_similar_film_rename(self):
+        other = self.films[0]
+        SimilarFilm.objects.create(film=other, similar=self.film, score=1)
+        url = f'/films/{other.id}/'
+        response = self.assertCached(url, False)
+        self.film.name = 'Новое название'
+        self.change(self.film.save)
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertContains(self.assertCached(url), 'Новое название')
+
+    def test_partner_rename(self):
+        url = f'/people/{self.director.id}/'
+        response = self.assertCached(url, False)
+        self.assertContains(response, 'Часто работает с')
+        self.person.name = 'Новое имя'
+        self.change(self.person.save)
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertContains(self.assertCached(url), 'Новое имя')
+
+    def test_relation_changes(self):
+        film, genre, person = self.films[0], self.genres[2], self.people[-1]
+        pages = [f'/films/{film.id}/', f'/genres/{genre.id}/',
+                 f'/people/{person.id}/']
+        for url in pages:
+            self.assertCached(url, False)
+        self.change(lambda: film.genres.add(genre))
+        self.change(lambda: person.film_set.add(film))
+        for url in pages:
+            self.assertContains(self.assertCached(url, False), film.name)
+
+        self.change(film.genres.clear)
+        self.assertNotContains(
+            self.assertCached(f'/genres/{genre.id}/', False),
+            f'/films/{film.id}/')
+
+    def test_list_film_counts(self):
+        response = self.assertCached('/genres/?sort=popular', False)
+        self.assertEqual([genre.name for genre in response.context['genres']],
+                         ['Драма', 'Комедия', 'Фантастика'])
+        self.assertContains(response, '15 фильмов')
+        self.assertContains(response, '5 фильмов')
+        self.assertCached('/genres/?sort=popular')
+        self.assertCached('/countries/', False)
+
+        self.change(lambda: self.film.genres.remove(self.genre))
+        self.assertContains(self.assertCached('/genres/?sort=popular', False),
+                            '14 фильмов')
+        self.change(lambda: Film.objects.create(
+            name='Новый', country=self.country, director=self.director))
+        self.assertContains(self.assertCached('/countries/', False),
+                            '16 фильмов')
+
+    def test_named_object_change(self):
+        self.assertCached('/countries/', False)
+        self.assertCached(f'/films/{self.film.id}/', False)
+        self.country.name = 'Канада'
+        self.change(self.country.save)
+        self.assertContains(self.assertCached('/countries/', False), 'Канада')
+        self.assertContains(
+            self.assertCached(f'/films/{self.film.id}/', False), 'Канада')
+
+    def test_related_saves_touch_films_in_one_update(self):
+        url = f'/films/{self.film.id}/'
+        self.assertCached(url, False)
+        for obj in (self.genre, self.country, self.director):
+            with CaptureQueriesContext(connection) as queries:
+                self.change(obj.save)
+            # Один UPDATE по условию или подзапросу, без списка id фильмов
+            updates = [query['sql'] for query in queries
+                       if query['sql'].startswith('UPDATE "films_film"')]
+            self.assertEqual(len(updates), 1)
+            self.assertNotRegex(updates[0], r'IN \(\d')
+            self.assertCached(url, False)
+        self.change(self.genre.film_set.clear)
+        self.assertNotContains(self.assertCached(url, False),
+                               f'/genres/{self.genre.id}/')
+
+    def test_person_count(self):
+        people = self.client.get('/people/').context['people']
+        self.assertEqual(people.count, 11)
+        Person.objects.create(name='Новый')
+        people = self.client.get('/people/').context['people']
+        self.assertEqual(people.count, 12)
+
+
+class FragmentCacheTest(CatalogTestData, TestCase):
+    # Для администратора страницы не кешируются целиком, только фрагменты
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def test_detail_lists_are_cached(self):
+        url = f'/films/{self.film.id}/'
+        self.client.get(url)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_fragments_follow_related_changes(self):
+        url = f'/films/{self.film.id}/'
+        self.client.get(url)
+        self.assertContains(self.client.get(f'/countries/{self.country.id}/'),
+                            self.film.name)
+        self.genre.name = 'Нуар'
+        self.genre.save()
+        self.person.name = 'Новое имя'
+        self.person.save()
+        self.assertContains(self.client.get(url), 'Нуар')
+        self.assertContains(self.client.get(url), 'Новое имя')
+        self.film.genres.remove(self.genre)
+        self.assertNotContains(self.client.get(url), 'Нуар')
+
+        self.film.name = 'Другое название'
+        self.film.save()
+        self.assertContains(self.client.get(f'/countries/{self.country.id}/'),
+                            'Другое название')
+
+
+class ConditionalGetTest(CatalogTestData, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_not_modified(self):
+        for url in ('/films/', f'/films/{self.film.id}/', '/people/',
+                    f'/people/{self.person.id}/', '/countries/',
+                    f'/countries/{self.country.id}/', '/genres/',
+                    f'/genres/{self.genre.id}/'):
+            with self.subTest(url):
+                response = self.client.get(url)
+                self.assertIn('Last-Modified', response)
+                with self.assertNumQueries(0):
+                    self.assertEqual(
+                        self.revalidate(url, response).status_code, 304)
+                self.assertEqual(self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                    .status_code, 304)
+
+    def test_changes_and_users(self):
+        url = f'/people/{self.person.id}/'
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film.name = 'Новое название'
+            self.film.save()
+        changed = self.revalidate(url, response)
+        self.assertContains(changed, 'Новое название')
+
+        # Страница администратора другая, анонимный ETag ей не подходит
+        self.client.force_login(self.admin)
+        response = self.revalidate(url, changed)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Film.objects.filter(people=self.person).first().delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class KeysetPaginationTest(CatalogTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Одинаковые названия на границе первой страницы: порядок
+        # задаёт id
+        for _ in range(13):
+            Film.objects.create(name='Дубль', country=cls.country,
+                                director=cls.director)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.url = f'/countries/{self.country.id}/'
+
+    def page(self, cursor=''):
+        return self.client.get(self.url, {'cursor': cursor}) \
+            .context['films']
+
+    def ids(self, page):
+        return [film.id for film in page]
+
+    def test_round_trip(self):
+        expected = list(Film.objects.filter(country=self.country)
+                        .order_by('name', 'id').values_list('id', flat=True))
+        pages = [self.page()]
+        while pages[-1].has_next():
+            pages.append(self.page(pages[-1].next_cursor))
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertEqual([page.num_pages for page in pages], [3, 3, 3])
+        self.assertEqual(sum(map(self.ids, pages), []), expected)
+        self.assertFalse(pages[0].has_previous())
+
+        # Обратно до первой страницы: те же строки и номера
+        page = pages[-1]
+        for number in [2, 1]:
+            page = self.page(page.previous_cursor)
+            self.assertEqual(page.number, number)
+            self.assertEqual(self.ids(page), self.ids(pages[number - 1]))
+        self.assertFalse(page.has_previous())
+        self.assertEqual(self.page(page.next_cursor).number, 2)
+
+    def test_bad_cursors(self):
+        first = self.ids(self.page())
+        film = Film.objects.order_by('id').last()
+        for cursor in ['мусор', 'e30', encode_cursor('back', [], 2),
+                       # Курсор другого ключа и значения не того типа
+                       encode_cursor('next', [1, 2, 3], 4),
+                       encode_cursor('next', [film.name, 'id'], 2)]:
+            with self.subTest(cursor):
+                page = self.page(cursor)
+                self.assertEqual(page.number, 1)
+                self.assertEqual(self.ids(page), first)
+
+
+def film_doc(i, **kwargs):
+    doc = {
+        'id': 1000 + i, 'name': f'Фильм {i}', 'enName': f'Film {i}',
+        'slogan': None, 'movieLength': 90 + i, 'year': 2000 + i,
+        'description': 'Описание', 'countries': [{'name': f'Страна {i % 2}'}],
+        'genres': [{'name': 'драма'}, {'name': f'жанр {i % 3}'}],
+        'persons': [
+            {'id': 1, 'name': 'Режиссёр', 'enName': 'Director',
+             'profession': 'режиссеры'},
+            {'id': 10 + i, 'name': f'Актёр {i}', 'enName': None,
+             'profession': 'актеры', 'birthday': '1970-01-02T00:00:00.000Z'},
+            {'id': 2, 'name': 'Звезда', 'enName': 'Star',
+             'profession': 'актеры'},
+        ],
+        'videos': {'trailers': []},
+    }
+    doc.update(kwargs)
+    return doc
+
+
+def import_docs(docs, *args):
+    command = ImportCommand()
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+        json.dump({'docs': docs}, f)
+        f.flush()
+        call_command(command, '--file', f.name, *args)
+    return command.stats
+
+
+class ImportFilmsTest(TestCase):
+
+    def test_import_and_update(self):
+        import_docs([film_doc(i) for i in range(6)])
+        self.assertEqual(Film.objects.count(), 6)
+        self.assertEqual(Person.objects.count(), 8)
+        self.assertEqual(Country.objects.count(), 2)
+        self.assertEqual(Genre.objects.count(), 4)
+        film = Film.objects.get(kinopoisk_id=1003)
+        self.assertEqual(film.director.name, 'Режиссёр')
+        self.assertEqual(set(film.people.values_list('kinopoisk_id',
+                                                     flat=True)), {13, 2})
+        self.assertEqual(str(Person.objects.get(kinopoisk_id=13).birthday),
+                         '1970-01-02')
+
+        import_docs([film_doc(3, name='Новое имя',
+                              genres=[{'name': 'комедия'}])])
+        film.refresh_from_db()
+        self.assertEqual(film.name, 'Новое имя')
+        self.assertEqual(list(film.genres.values_list('name', flat=True)),
+                         ['комедия'])
+        self.assertEqual(Film.objects.count(), 6)
+
+    def test_person_count_after_import(self):
+        cache.clear()
+        self.assertEqual(self.client.get('/people/').context['people'].count,
+                         0)
+        import_docs([film_doc(i) for i in range(6)])
+        self.assertEqual(self.client.get('/people/').context['people'].count,
+                         8)
+
+    def test_skips_film_without_director(self):
+        import_docs([film_doc(0, persons=[])])
+        self.assertFalse(Film.objects.exists())
+
+    def test_queries_scale_with_batches(self):
+        def count(films):
+            with CaptureQueriesContext(connection) as queries:
+                import_docs([film_doc(i) for i in range(films)],
+                            '--batch-size', '50', '--force')
+            return len(queries)
+        self.assertEqual(count(5), count(40))
+
+    def test_incremental_import(self):
+        docs = [film_doc(i) for i in range(6)]
+        stats = import_docs(docs)
+        self.assertEqual(stats['added'], 6)
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = import_docs(docs)
+        self.assertEqual(stats['unchanged'], 6)
+        self.assertFalse([query for query in queries
+                          if not query['sql'].startswith('SELECT')])
+
+        docs[2] = film_doc(2, year=1950)
+        docs[5]['persons'][0]['name'] = 'Другой режиссёр'
+        stats = import_docs(docs[1:])
+        self.assertEqual((stats['added'], stats['changed'],
+                          stats['unchanged'], stats['removed'],
+                          stats['missing']), (0, 2, 3, 0, 1))
+        self.assertEqual(Film.objects.get(kinopoisk_id=1002).year, 1950)
+        self.assertEqual(Person.objects.get(kinopoisk_id=1).name,
+                         'Другой режиссёр')
+        self.assertTrue(Film.objects.filter(kinopoisk_id=1000).exists())
+
+        stats = import_docs(docs[1:], '--prune')
+        self.assertEqual((stats['unchanged'], stats['removed'],
+                          stats['missing']), (5, 1, 0))
+        self.assertFalse(Film.objects.filter(kinopoisk_id=1000).exists())
+
+
+class StubServer(ThreadingHTTPServer):
+    # Локальный HTTP-сервер для тестов, ответ строит respond(path, query)
+    def __init__(self):
+        self.hits = Counter()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(handler):
+                url = urlsplit(handler.path)
+                self.hits[handler.path] += 1
+                status, body = self.respond(url.path, parse_qs(url.query))
+                handler.send_response(status)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+
+    def respond(self, path, query):
+        raise NotImplementedError
+
+    def url(self, path=''):
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+    def start(self, test):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        test.addCleanup(self.server_close)
+        test.addCleanup(self.shutdown)
+        return self
+
+
+class StubImageServer(StubServer):
+    # Отдаёт /<имя>[-<суффикс>].jpg с содержимым «<имя>»
+    def respond(self, path, query):
+        if path.startswith('/missing'):
+            return 404, b''
+        return 200, path.split('-')[0].split('.')[0].encode()
+
+
+class ImportImagesTest(TestCase):
+    def setUp(self):
+        self.server = StubImageServer().start(self)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media = media.name
+
+    def test_downloads_are_deduplicated(self):
+        star = {'id': 2, 'name': 'Звезда', 'enName': 'Star',
+                'profession': 'актеры', 'photo': self.server.url('/star.jpg')}
+        docs = []
+        for i in range(4):
+            doc = film_doc(i, poster={'url': self.server.url(
+                '/poster.jpg' if i < 2 else f'/poster-{i}.jpg')})
+            doc['persons'][2] = star
+            docs.append(doc)
+        docs[3]['poster']['url'] = self.server.url('/missing.jpg')
+        import_docs(docs, '--batch-size', '2')
+
+        # Каждый URL запрошен один раз, одинаковое содержимое — один файл
+        self.assertEqual(set(self.server.hits.values()), {1})
+        covers = Film.objects.exclude(cover='').values_list('cover', flat=True)
+        self.assertEqual(len(covers), 3)
+        self.assertEqual(len(set(covers)), 1)
+        self.assertTrue(all(name.startswith('covers/') for name in covers))
+        self.assertFalse(Film.objects.get(kinopoisk_id=1003).cover)
+        photo = Person.objects.get(kinopoisk_id=2).photo
+        self.assertTrue(photo.name.startswith('photos/'))
+        with photo.open() as f:
+            self.assertEqual(f.read(), b'/star')
+
+        # Изменённые фильмы с теми же картинками: файлы берутся по
+        # записанным URL, без скачивания
+        for doc in docs:
+            doc['description'] = 'Новое описание'
+            doc['persons'][2]['name'] = 'Звезда экрана'
+        import_docs(docs, '--batch-size', '2')
+        self.assertEqual(self.server.hits['/poster.jpg'], 1)
+        self.assertEqual(self.server.hits['/star.jpg'], 1)
+        self.assertEqual(self.server.hits['/missing.jpg'], 2)
+        self.assertEqual(Person.objects.get(kinopoisk_id=2).photo, photo)
+
+
+class FakePoiskKino(StubServer):
+    # Фейк /v1.4/movie и /v1.4/person: 7 фильмов по 3 на странице,
+    # failures[(путь, страница)] — статусы ответов до успешного
+    PAGE = 3
+
+    def __init__(self):
+        super().__init__()
+        self.films = [film_doc(i) for i in range(7)]
+        self.failures = {}
+
+    def respond(self, path, query):
+        page = int(query['page'][0])
+        statuses = self.failures.get((path, page))
+        if statuses:
+            return statuses.pop(0), b''
+        if path == '/v1.4/movie':
+            docs = self.films
+        else:
+            ids = {int(film_id) for film_id in query['movies.id']}
+            docs = [{'id': person['id'], 'birthday': '1960-05-05'}
+                    for film in self.films if film['id'] in ids
+                    for person in film['persons']]
+        pages = -(-len(docs) // self.PAGE)
+        docs = docs[(page - 1) * self.PAGE:page * self.PAGE]
+        return 200, json.dumps({'docs': docs, 'pages': pages}).encode()
+
+
+class GetFilmsTest(TestCase):
+    def setUp(self):
+        self.server = FakePoiskKino().start(self)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.output = os.path.join(tmp.name, 'films.json')
+
+    def get_films(self, *args):
+        call_command('get_films', '--base-url', self.server.url(),
+                     '--output', self.output, '--rate', '0',
+                     '--retries', '2', '--backoff', '0.01', *args)
+        with open(self.output) as f:
+            return json.load(f)['docs']
+
+    def test_fetches_all_pages_with_retries(self):
+        self.server.failures = {('/v1.4/movie', 2): [500, 429],
+                                ('/v1.4/person', 1): [503]}
+        docs = self.get_films()
+        self.assertEqual(sorted(doc['id'] for doc in docs),
+                         [film['id'] for film in self.server.films])
+        self.assertEqual(docs[0]['persons'][0]['birthday'], '1960-05-05')
+        self.assertEqual(os.listdir(os.path.dirname(self.output)),
+                         ['films.json'])
+
+    def test_resumes_after_failure(self):
+        self.server.failures = {('/v1.4/movie', 3): [500] * 3}
+        with self.assertRaises(CommandError):
+            self.get_films('--workers', '1')
+        self.assertTrue(os.path.exists(self.output + '.checkpoint'))
+        self.server.hits.clear()
+        docs = self.get_films()
+        self.assertEqual(len(docs), 7)
+        # Готовые страницы повторно не запрашиваются
+        movie_pages = [path for path in self.server.hits
+                       if path.startswith('/v1.4/movie')]
+        self.assertEqual(len(movie_pages), 1)
+        self.assertIn('page=3', movie_pages[0])
+
+
+class ReadersTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.docs = [film_doc(i) for i in range(5)]
+
+    def write(self, name, text, opener=open):
+        path = os.path.join(self.dir, name)
+        with opener(path, 'wt', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_formats(self):
+        ndjson = ''.join(json.dumps(doc) + '\n' for doc in self.docs)
+        variants = {
+            'indented.json': json.dumps({'docs': self.docs}, indent=4),
+            'minified.json': json.dumps({'total': 5, 'docs': self.docs,
+                                         'pages': 1}),
+            'list.json': json.dumps(self.docs),
+            'films.ndjson': ndjson,
+        }
+        for name, text in variants.items():
+            for opener in (open, gzip.open):
+                with self.subTest(name, opener=opener.__module__):
+                    path = self.write(name, text, opener)
+                    self.assertEqual(list(iter_docs(path)), self.docs)
+
+    @unittest.skipUnless(zstandard, 'zstandard is not installed')
+    def test_zstd(self):
+        path = os.path.join(self.dir, 'films.ndjson.zst')
+        with zstandard.open(path, 'wt', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(doc) + '\n' for doc in self.docs))
+        self.assertEqual(list(iter_docs(path)), self.docs)
+
+    def test_invalid(self):
+        for text in ('{\n"total": 1\n}', '{"docs": [{"id": 1}', '[1, 2'):
+            with self.subTest(text), self.assertRaises(ValueError):
+                list(iter_docs(self.write('bad.json', text)))
+
+    def test_long_ndjson_line(self):
+        # Первая строка длиннее нескольких кусков чтения
+        self.docs[0]['description'] = 'Описание ' * 50000
+        path = self.write('long.ndjson', ''.join(
+            json.dumps(doc, ensure_ascii=False) + '\n' for doc in self.docs))
+        self.assertEqual(list(iter_docs(path)), self.docs)
+
+    def test_number_at_chunk_boundary(self):
+        stream = JSONStream(io.StringIO('34, 5]'))
+        stream.buffer = '[12'
+        self.assertEqual(list(stream.items()), [1234, 5])
+
+    def test_memory_does_not_grow_with_input(self):
+        doc = film_doc(0, description='Описание ' * 500)
+
+        def peak(films):
+            path = self.write('big.json', json.dumps(
+                {'docs': [doc] * films}, ensure_ascii=False, indent=1))
+            tracemalloc.start()
+            for _ in iter_docs(path):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak
+        self.assertLess(peak(2000), peak(200) * 2)
+
+    def test_import_compressed_ndjson(self):
+        path = self.write('films.ndjson.gz', ''.join(
+            json.dumps(doc) + '\n' for doc in self.docs), gzip.open)
+        call_command('import_films', '--file', path, '--batch-size', '2')
+        self.assertEqual(Film.objects.count(), 5)
+
+
+class SnapshotTest(CatalogTestData, TestCase):
+    def test_export_and_load(self):
+        from news.models import Comment, News, Reaction
+        news = News.objects.create(title='Новость')
+        comment = Comment.objects.create(news=news, user=self.admin,
+                                         content='Текст')
+        Comment.objects.create(news=news, user=self.admin, content='Ответ',
+                               parent=comment)
+        Reaction.objects.create(news=news, user=self.admin,
+                                reaction_type=Reaction.LIKE)
+        expected = {
+            'people': list(self.film.people.values_list('id', flat=True)),
+            'genres': list(self.film.genres.values_list('id', flat=True)),
+            'film': Film.objects.values().get(id=self.film.id),
+            'comments': list(Comment.objects.values().order_by('id')),
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'snapshot.ndjson.gz')
+            call_command('export_snapshot', '--output', path,
+                         '--batch-size', '4')
+            with self.assertRaises(CommandError):
+                call_command('load_snapshot', '--input', path)
+            call_command('load_snapshot', '--input', path, '--flush',
+                         '--batch-size', '4')
+
+        film = Film.objects.get(id=self.film.id)
+        self.assertEqual(Film.objects.values().get(id=film.id),
+                         expected['film'])
+        self.assertEqual(list(film.people.values_list('id', flat=True)),
+                         expected['people'])
+        self.assertEqual(list(film.genres.values_list('id', flat=True)),
+                         expected['genres'])
+        self.assertEqual(list(Comment.objects.values().order_by('id')),
+                         expected['comments'])
+        self.assertEqual(Reaction.objects.get().user, self.admin)
+        # Счётчики в снимке нулевые, как в снимках до их появления
+        self.assertEqual(News.objects.values_list(
+            'likes_total', 'comments_total').get(), (1, 2))
+        self.assertEqual(User.objects.get().check_password('admin'), True)
+        self.assertEqual(Film.objects.count(), 15)
+        self.assertEqual(search(Film.objects.all(), 'фильм').count(), 15)
+        self.assertGreater(Country.objects.create(name='Франция').id,
+                           self.country.id)
+
+
+class BenchmarkViewsTest(CatalogTestData, TestCase):
+    def test_routes(self):
+        from news.models import Comment, News, NewsBlock
+        news = News.objects.create(title='Новость')
+        block = NewsBlock.objects.create(news=news, title='Блок')
+        comment = Comment.objects.create(news=news, user=self.admin,
+                                         content='Текст')
+        command = benchmark_views.Command()
+        command.samples = command.get_samples()
+        routes = dict(command.get_routes())
+        self.assertNotIn('news:reaction_toggle', routes)
+        self.assertEqual(routes['news:comment_list'],
+                         f'/news/{news.id}/comments/')
+        self.assertEqual(routes['news:comment_update'],
+                         f'/news/comment/{comment.id}/update/')
+        self.assertEqual(routes['news:news_block_create'],
+                         f'/news/block/{block.id}/create/')
+        self.assertIn(f'/films/{command.samples["film"]}/', routes.values())
+
+
+@unittest.skipUnless(numpy, 'numpy is not installed')
+class SimilarFilmsTest(CatalogTestData, TestCase):
+    def similar(self, film):
+        return list(film.similar_films.values_list('similar', flat=True))
+
+    def test_build(self):
+        call_command('build_similar', '--top', '3')
+        self.assertEqual(SimilarFilm.objects.count(), 15 * 3)
+        for film in self.films:
+            scores = list(film.similar_films.values_list('score', flat=True))
+            self.assertNotIn(film.id, self.similar(film))
+            self.assertEqual(scores, sorted(scores, reverse=True))
+        # Соседний год и почти тот же состав
+        self.assertIn(self.films[12].id, self.similar(self.films[13]))
+        response = self.client.get(f'/films/{self.film.id}/')
+        self.assertContains(response, 'Похожие фильмы')
+        self.assertContains(response, self.films[13].name)
+
+    def test_incremental(self):
+        call_command('build_similar', '--top', '3')
+        first = self.films[0]
+        self.assertNotIn(first.id, self.similar(self.film))
+        first.year = self.film.year
+        first.save()
+        first.genres.set(self.genres)
+        first.people.set(self.film.people.all())
+        call_command('build_similar', '--incremental', '--top', '3')
+        self.assertEqual(self.similar(self.film)[0], first.id)
+        self.assertEqual(self.similar(first)[0], self.film.id)
+        self.assertEqual(SimilarFilm.objects.count(), 15 * 3)
+
+
+class CollaborationGraphTest(CatalogTestData, TestCase):
+    def edges(self):
+        return set(Collaboration.objects.values_list(
+            'person', 'partner', 'films'))
+
+    def assertGraphRebuilt(self):
+        # Граф, обновлённый сигналами, совпадает с построенным заново
+        edges = self.edges()
+        graph.rebuild()
+        self.assertEqual(edges, self.edges())
+
+    def test_signals_update_graph(self):
+        self.assertIn((self.people[0].id, self.director.id, 15),
+                      self.edges())
+        film = self.films[3]
+        film.people.remove(self.people[0])
+        film.people.add(self.people[9], self.director)
+        film.director = self.people[1]
+        film.save()
+        self.people[2].film_set.clear()
+        self.people[5].film_set.add(self.films[0])
+        self.films[4].people.clear()
+        self.films[5].delete()
+        self.assertGraphRebuilt()
+
+    def test_import_updates_graph(self):
+        import_docs([film_doc(i) for i in range(4)])
+        persons = film_doc(1)['persons'][:2]
+        import_docs([film_doc(1, persons=persons), film_doc(5)])
+        self.assertGraphRebuilt()
+
+    def test_collaborators_and_path(self):
+        loner, friend = (Person.objects.create(name=name)
+                         for name in ('Одиночка', 'Друг'))
+        film = Film.objects.create(name='Дебют', country=self.country,
+                                   director=loner)
+        film.people.add(friend)
+        path = [self.people[9].id, self.director.id, friend.id, loner.id]
+        self.assertIsNone(graph.shortest_path(path[0], path[-1]))
+        Film.objects.create(name='Камео', country=self.country,
+                            director=self.director).people.add(friend)
+        self.assertEqual(graph.shortest_path(path[0], path[-1]), path)
+        self.assertEqual(graph.shortest_path(path[0], path[-1], 2), None)
+
+        response = self.client.get(f'/people/{self.director.id}/')
+        self.assertContains(response, 'Часто работает с')
+        self.assertContains(response, '15 фильмов')
+        response = self.client.get('/people/path/', {
+            'source': path[0], 'target': path[-1]})
+        self.assertEqual([person.id for person, film in
+                          response.context['steps']], path)
+        self.assertContains(response, 'Камео')
+
+
+class FacetsTest(CatalogTestData, TestCase):
+    def setUp(self):
+        # Откат транзакции теста не меняет версии тегов, индекс сбрасываем
+        cache.clear()
+
+    def counts(self, query):
+        filters = parse_filters(QueryDict(query))
+        return filters, facet_index().counts(filters)
+
+    def test_counts_match_sql(self):
+        comedy = self.genres[1]
+        filters, counts = self.counts(
+            f'genre={comedy.id}&year_from=2000&year_to=2004')
+        films = filter_films(Film.objects.all(), filters)
+        self.assertEqual(counts['total'], films.count())
+        self.assertEqual(counts['total'], 4)
+        for genre, name, count in counts['genre']:
+            self.assertEqual(count, films.filter(genres=genre).count())
+        # Свой диапазон лет к счётчикам десятилетий не применяется
+        decades = {label: count for value, label, count in counts['year']}
+        self.assertEqual(decades, {'1990-е': 6, '2000-е': 4})
+        self.assertEqual(
+            [count for value, label, count in counts['length']], [0, 0, 0, 0])
+
+    def test_index_follows_changes(self):
+        genre = self.genres[2]
+        self.assertEqual(self.counts(f'genre={genre.id}')[1]['total'], 5)
+        film = Film.objects.create(name='Новый', country=self.country,
+                                   director=self.director, length=95)
+        film.genres.add(genre)
+        filters, counts = self.counts(f'genre={genre.id}&length_to=100')
+        self.assertEqual(counts['total'], 1)
+        self.assertEqual(counts['length'][1][2], 1)
+
+    def test_stale_index_while_rebuilding(self):
+        index = facet_index()
+        Film.objects.create(name='Новый', country=self.country,
+                            director=self.director)
+        # Пересборку уже ведёт другой поток: отдаётся прежний индекс
+        with facets._lock:
+            with self.assertNumQueries(0):
+                self.assertIs(facet_index(), index)
+        self.assertEqual(facet_index().counts(
+            parse_filters(QueryDict()))['total'], 16)
+
+    def test_list_page(self):
+        genre = self.genres[2]
+        response = self.client.get('/films/', {'genre': genre.id,
+                                               'director': self.director.id})
+        self.assertEqual(len(response.context['films']), 5)
+        self.assertContains(response, 'Найдено 5 фильмов')
+        # Повторный выбор снимает фильтр
+        self.assertContains(response, f'href="?director={self.director.id}"')
+
+    def test_search_with_country(self):
+        france = Country.objects.create(name='Франция')
+        Film.objects.filter(id__in=[film.id for film in self.films[:3]]) \
+            .update(country=france)
+        response = self.client.get('/films/', {'query': 'фильм',
+                                               'country': self.country.id})
+        self.assertEqual(len(response.context['films']), 12)
+        countries = {label: count for value, label, count, chosen in
+                     dict((name, options) for title, name, options in
+                          response.context['facets'])['country']}
+        # Страна не ограничивает счётчики своей группы
+        self.assertEqual(countries, {'США': 12, 'Франция': 3})
+
+    def test_malformed_numbers(self):
+        filters = parse_filters(QueryDict('year_from=²&country=-1&genre=²'))
+        self.assertEqual(filters['year'], (None, None))
+        self.assertIsNone(filters['country'])
+        self.assertEqual(filters['genre'], [])
+        self.assertEqual(self.client.get('/films/', {'year_from': '²'})
+                         .status_code, 200)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'FTS5 is SQLite-only')
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='США')
+        director = Person.objects.create(name='Лана Вачовски')
+
+        def film(name, **kwargs):
+            return Film.objects.create(name=name, country=country,
+                                       director=director, **kwargs)
+        cls.matrix = film('Матрица', origin_name='The Matrix',
+                          description='Хакер узнаёт правду о мире')
+        cls.about = film('Хакеры', description='Фильм о матрице и хакерах')
+        cls.runner = film('Бегущий по лезвию', origin_name='Blade Runner')
+
+    def names(self, query, model=Film):
+        return list(search(model.objects.all(), query)
+                    .values_list('name', flat=True))
+
+    def test_rank(self):
+        # Совпадение в названии весит больше, чем в описании
+        self.assertEqual(self.names('хакер'), ['Хакеры', 'Матрица'])
+        self.assertEqual(self.names('матрица'), ['Матрица', 'Хакеры'])
+
+    def test_word_forms(self):
+        # Русские окончания отрезаются, английские стеммит porter
+        self.assertEqual(self.names('матрицей'), ['Матрица', 'Хакеры'])
+        self.assertEqual(self.names('бегущего'), ['Бегущий по лезвию'])
+        self.assertEqual(self.names('runners'), ['Бегущий по лезвию'])
+        self.assertEqual(self.names('вачовски', Person), ['Лана Вачовски'])
+        self.assertEqual(self.names('!!'), [])
+
+    def test_index_follows_changes(self):
+        self.runner.name = 'Андроиды'
+        self.runner.save()
+        self.assertEqual(self.names('бегущий'), [])
+        self.assertEqual(self.names('андроиды'), ['Андроиды'])
+        self.matrix.delete()
+        self.assertEqual(self.names('матрица'), ['Хакеры'])
+        Film.objects.filter(id=self.about.id).update(description='')
+        self.assertEqual(self.names('матрица'), [])
+
+
+class PrefixIndexTest(CatalogTestData, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def names(self, model, query):
+        return sorted(complete(model.objects.all(), query)
+                      .values_list('name', flat=True))
+
+    def test_word_prefixes(self):
+        Person.objects.create(name='Пётр Иванов', origin_name='Pyotr Ivanov')
+        self.assertEqual(self.names(Person, 'петр'), ['Пётр Иванов'])
+        self.assertEqual(self.names(Person, 'ИВАН'), ['Пётр Иванов'])
+        self.assertEqual(self.names(Person, 'ivan'), ['Пётр Иванов'])
+        self.assertEqual(len(self.names(Person, 'актер')), 10)
+        self.assertEqual(self.names(Country, 'сш'), ['США'])
+        response = self.client.get('/people/autocomplete/',
+                                   {'q': 'режисс'})
+        self.assertEqual([item['text'] for item in response.json()['results']],
+                         ['Режиссёр'])
+
+    def test_changes(self):
+        self.assertEqual(self.names(Person, 'режиссер'), ['Режиссёр'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.director.name = 'Постановщик'
+            self.director.save()
+        self.assertEqual(self.names(Person, 'режиссер'), [])
+        self.assertEqual(self.names(Person, 'постан'), ['Постановщик'])
+        self.people[0].delete()
+        self.assertEqual(len(self.names(Person, 'actor')), 9)
+
+    def test_memory_limit(self):
+        with patch('films.prefix.MEMORY_LIMIT', 100):
+            self.assertIsNone(INDEXES[Person].search('актер'))
+            self.assertEqual(len(self.names(Person, 'Актёр')), 10)
+        # Оценка по БД отказывает, не выбирая строки
+        with patch('films.prefix.MEMORY_LIMIT', 3000):
+            with self.assertNumQueries(1):
+                INDEXES[Person].build()
+            self.assertIsNone(INDEXES[Person].data)
@@ -37,6 +37,7 @@ urlpatterns = [
          views.person_update, name='person_update'),
     path('people/<int:id>/delete/',
          views.person_delete, name='person_delete'),
+    path('people/path/', views.person_path, name='person_path'),
     path('people/autocomplete/',
          views.PersonAutocomplete.as_view(), name='person_autocomplete'),
 ]
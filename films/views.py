@@ -1,26 +1,53 @@
 from dal import autocomplete
+from django.db.models import Count, Q
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import user_passes_test
 from .models import Country, Film, Genre, Person
-from .forms import CountryForm, GenreForm, FilmForm, PersonForm
-from .helpers import paginate
+from .forms import CountryForm, GenreForm, FilmForm, PathForm, PersonForm
+from .cache import CATALOG_TAG, FILM_PAGES_TAG, cache_page, cached
+from .facets import facet_groups, facet_index, filter_films, parse_filters
+from .graph import shortest_path
+from .prefix import complete
+from .helpers import COUNT_TIMEOUT, conditional_page, paginate
+from .search import search
 from django.contrib import messages
 
+SIMILAR_FILMS = 8
+COLLABORATORS = 10
+LIST_SORTS = {'name': ['name'], 'popular': ['-films_count', 'name']}
+
 
 def check_admin(user):
     return user.is_superuser
 
 
+def with_film_counts(request, model, tag):
+    # Один запрос с COUNT на весь список. Сигналы сбрасывают тег списка,
+    # когда у фильма меняются страна или жанры.
+    sort = request.GET.get('sort')
+    if sort not in LIST_SORTS:
+        sort = 'name'
+    queryset = model.objects.annotate(films_count=Count('film')) \
+        .order_by(*LIST_SORTS[sort])
+    return sort, cached(f'list:{tag}:{sort}', [CATALOG_TAG, tag],
+                        lambda: list(queryset), COUNT_TIMEOUT)
+
+
+@conditional_page(lambda: ['countries'])
+@cache_page(lambda: ['countries'])
 def country_list(request):
-    countries = Country.objects.all()
-    return render(request, 'films/country/list.html', {'countries': countries})
+    sort, countries = with_film_counts(request, Country, 'countries')
+    return render(request, 'films/country/list.html',
+                  {'countries': countries, 'sort': sort})
 
 
+@conditional_page(lambda id: [f'country:{id}'])
+@cache_page(lambda id: [f'country:{id}'])
 def country_detail(request, id):
     country = get_object_or_404(Country, id=id)
     films = Film.objects.filter(country=country)
 
-    films = paginate(request, films)
+    films = paginate(request, films, keyset=('name', 'id'))
     return render(request, 'films/country/detail.html',
                   {'country': country, 'films': films})
 
@@ -64,16 +91,21 @@ def country_delete(request, id):
                   {'country': country})
 
 
+@conditional_page(lambda: ['genres'])
+@cache_page(lambda: ['genres'])
 def genre_list(request):
-    genres = Genre.objects.all()
-    return render(request, 'films/genre/list.html', {'genres': genres})
+    sort, genres = with_film_counts(request, Genre, 'genres')
+    return render(request, 'films/genre/list.html',
+                  {'genres': genres, 'sort': sort})
 
 
+@conditional_page(lambda id: [f'genre:{id}'])
+@cache_page(lambda id: [f'genre:{id}'])
 def genre_detail(request, id):
     genre = get_object_or_404(Genre, id=id)
     films = Film.objects.filter(genres=genre)
 
-    films = paginate(request, films)
+    films = paginate(request, films, keyset=('name', 'id'))
     return render(request, 'films/genre/detail.html',
                   {'genre': genre, 'films': films})
 
@@ -117,22 +149,43 @@ def genre_delete(request, id):
                   {'genre': genre})
 
 
+@conditional_page(lambda: ['films', 'genres', 'countries'])
+@cache_page(lambda: ['films', 'genres', 'countries'])
 def film_list(request):
-    films = Film.objects.all()
+    filters = parse_filters(request.GET)
     query = request.GET.get('query', '')
+    found = None
     if query:
-        films = films.filter(name__icontains=query)
-    films = paginate(request, films)
-    return render(request, 'films/film/list.html', {'films': films,
-                                                    'query': query})
-
-
+        # Найденные без фильтров: фасет не применяет фильтр своей группы,
+        # поэтому их карта должна включать фильмы других стран и лет.
+        # Результаты поиска упорядочены по релевантности, курсор по имени
+        # к ним не применим
+        films = search(Film.objects.all(), query)
+        found = list(films.values_list('id', flat=True))
+        films = paginate(request, filter_films(films, filters))
+    else:
+        films = paginate(request, filter_films(Film.objects.all(), filters),
+                         keyset=('name', 'id'))
+    counts = facet_index().counts(filters, found)
+    director = filters['director'] and \
+        Person.objects.filter(id=filters['director']).first()
+    return render(request, 'films/film/list.html', {
+        'films': films, 'query': query, 'total': counts['total'],
+        'facets': facet_groups(filters, counts), 'director': director})
+
+
+@conditional_page(lambda id: [f'film:{id}', FILM_PAGES_TAG])
+@cache_page(lambda id: [f'film:{id}', FILM_PAGES_TAG])
 def film_detail(request, id):
-    queryset = Film.objects.prefetch_related("country", "genres", "director",
-                                             "people")
+    # Жанры и актёры запрашиваются в шаблоне, только если их фрагмент
+    # не найден в кеше
+    queryset = Film.objects.select_related("country", "director")
     film = get_object_or_404(queryset, id=id)
+    # Похожие фильмы заранее посчитаны командой build_similar
+    similar = [item.similar for item in film.similar_films
+               .select_related('similar')[:SIMILAR_FILMS]]
     return render(request, 'films/film/detail.html',
-                  {'film': film})
+                  {'film': film, 'similar': similar})
 
 
 @user_passes_test(check_admin)
@@ -174,21 +227,47 @@ def film_delete(request, id):
                   {'film': film})
 
 
+@conditional_page(lambda: ['people'])
 def person_list(request):
     people = Person.objects.all()
     query = request.GET.get('query', '')
     if query:
-        people = people.filter(name__icontains=query)
-    people = paginate(request, people)
+        people = paginate(request, search(people, query))
+    else:
+        people = paginate(request, people, keyset=('name', 'id'))
     return render(request, 'films/person/list.html', {'people': people,
                                                       'query': query})
 
 
+@conditional_page(lambda id: [f'person:{id}'])
+@cache_page(lambda id: [f'person:{id}'])
 def person_detail(request, id):
     queryset = Person.objects.prefetch_related("film_set", "directed_films")
     person = get_object_or_404(queryset, id=id)
+    collaborators = person.collaborations.select_related('partner') \
+        .order_by('-films', 'partner__name')[:COLLABORATORS]
     return render(request, 'films/person/detail.html',
-                  {'person': person})
+                  {'person': person, 'collaborators': collaborators})
+
+
+def shared_film(person, partner):
+    return Film.objects.filter(Q(director=person) | Q(people=person)) \
+        .filter(Q(director=partner) | Q(people=partner)).first()
+
+
+def person_path(request):
+    form = PathForm(request.GET or None)
+    steps = path = None
+    if form.is_valid():
+        path = shortest_path(form.cleaned_data['source'].id,
+                             form.cleaned_data['target'].id)
+    if path:
+        # Персона и фильм, в котором она работала со следующей
+        people = Person.objects.in_bulk(path)
+        steps = [(people[person], partner and shared_film(person, partner))
+                 for person, partner in zip(path, path[1:] + [None])]
+    return render(request, 'films/person/path.html',
+                  {'form': form, 'steps': steps})
 
 
 @user_passes_test(check_admin)
@@ -234,7 +313,7 @@ class PersonAutocomplete(autocomplete.Select2QuerySetView):
     def get_queryset(self):
         people = Person.objects.all()
         if self.q:
-            people = people.filter(name__istartswith=self.q)
+            people = complete(people, self.q)
         return people
 
 
@@ -242,5 +321,5 @@ class CountryAutocomplete(autocomplete.Select2QuerySetView):
     def get_queryset(self):
         countries = Country.objects.all()
         if self.q:
-            countries = countries.filter(name__istartswith=self.q)
+            countries = complete(countries, self.q)
         return countries
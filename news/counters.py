@@ -0,0 +1,106 @@
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from films.helpers import db_value
+from films.signals import invalidate_on_commit
+from .models import Comment, News, Reaction
+
+REACTION_FIELDS = {Reaction.LIKE: 'likes_total',
+                   Reaction.DISLIKE: 'dislikes_total'}
+
+
+def add_reaction(target, reaction_type, delta):
+    """Меняет счётчик реакций новости или комментария на delta"""
+    field = REACTION_FIELDS.get(reaction_type)
+    if field:
+        type(target).objects.filter(id=target.id).update(
+            **{field: F(field) + delta})
+
+
+def toggle_reaction(user, target, reaction_type):
+    """Ставит реакцию на новость или комментарий, повторная такая же
+    снимает её. Возвращает реакцию пользователя после изменения.
+
+    Каждый шаг — один оператор, поэтому двойной клик из двух запросов
+    не создаёт вторую строку и не сбивает счётчики."""
+    field = target._meta.model_name
+    reactions = Reaction.objects.filter(user=user, **{field: target})
+    now = db_value(Reaction, 'created_at', timezone.now())
+    table = connection.ops.quote_name(Reaction._meta.db_table)
+    news_id = target.id if isinstance(target, News) else target.news_id
+    with transaction.atomic():
+        # Сигналов здесь нет, страницу новости сбрасываем сами
+        invalidate_on_commit(f'news:{news_id}')
+        if reactions.filter(reaction_type=reaction_type).delete()[0]:
+            add_reaction(target, reaction_type, -1)
+            return None
+        # Вставка или смена типа существующей реакции. Строка не
+        # возвращается, если такую же реакцию успел поставить другой
+        # запрос. У новой строки created_at и updated_at совпадают.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, {field}_id, reaction_type, '
+                f'created_at, updated_at) VALUES (%s, %s, %s, %s, %s) '
+                f'ON CONFLICT (user_id, {field}_id) DO UPDATE '
+                f'SET reaction_type = excluded.reaction_type, '
+                f'updated_at = excluded.updated_at '
+                f'WHERE {table}.reaction_type <> excluded.reaction_type '
+                f'RETURNING created_at = updated_at',
+                [user.id, target.id, reaction_type, now, now])
+            row = cursor.fetchone()
+        if row:
+            if not row[0]:
+                add_reaction(target, -reaction_type, -1)
+            add_reaction(target, reaction_type, 1)
+    return reaction_type
+
+
+def add_comments(news_id, delta):
+    if delta:
+        News.objects.filter(id=news_id).update(
+            comments_total=F('comments_total') + delta)
+
+
+def published_in_thread(comment):
+    """Опубликованные комментарии в ветке comment, включая его самого:
+    столько уйдёт из счётчика новости при каскадном удалении"""
+    replies = defaultdict(list)
+    published = {}
+    for id, parent_id, is_published in Comment.objects.filter(
+            news=comment.news_id).order_by().values_list(
+            'id', 'parent_id', 'is_published'):
+        replies[parent_id].append(id)
+        published[id] = is_published
+    total, stack = 0, [comment.id]
+    while stack:
+        id = stack.pop()
+        total += published[id]
+        stack += replies[id]
+    return total
+
+
+def count(model, field, **filters):
+    rows = model.objects.filter(**{field: OuterRef('pk')}, **filters) \
+        .order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows), 0)
+
+
+def reconcile(news_model=News, comment_model=Comment,
+              reaction_model=Reaction):
+    """Пересчитывает счётчики по таблицам, возвращает {модель: число
+    исправленных строк}. Модели передаются для вызова из миграции."""
+    totals = {}
+    for model, target, extra in [
+            (news_model, 'news', {'comments_total': count(
+                comment_model, 'news', is_published=True)}),
+            (comment_model, 'comment', {})]:
+        values = {field: count(reaction_model, target,
+                               reaction_type=reaction_type)
+                  for reaction_type, field in REACTION_FIELDS.items()}
+        values.update(extra)
+        # Обновляются только строки, где хранимое значение разошлось
+        totals[model._meta.label] = model.objects.exclude(**values) \
+            .update(**values)
+    return totals
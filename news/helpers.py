@@ -1,13 +1,64 @@
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-
-
-def paginate(request, collection, per=12):
-    paginator = Paginator(collection, per)
-    page = request.GET.get('page')
-    try:
-        collection = paginator.page(page)
-    except PageNotAnInteger:
-        collection = paginator.page(1)
-    except EmptyPage:
-        collection = paginator.page(paginator.num_pages)
-    return collection
+import re
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Q
+from films.helpers import conditional_page, paginate  # noqa: F401
+from films.helpers import decode_cursor, encode_cursor, keyset_filter
+from .models import Comment, Reaction
+
+# Комментариев одного уровня на странице: корневых у новости или ответов
+# на один комментарий. Ответы не выводятся, пока их не откроют.
+COMMENTS_PAGE = 20
+COMMENT_KEYSET = ('-published_at', '-id')
+# isdigit() пропускает «²» и другие цифры, которые не разбирает int()
+NUMBER = re.compile(r'[0-9]+')
+
+
+def comment_page(comments, cursor=''):
+    """(комментарии, курсор следующей страницы или None).
+
+    У каждого комментария replies_count — число опубликованных ответов."""
+    comments = comments.order_by(*COMMENT_KEYSET)
+    cursor = decode_cursor(cursor)
+    if cursor and cursor[0] == 'next' \
+            and len(cursor[1]) == len(COMMENT_KEYSET):
+        try:
+            comments = comments.filter(keyset_filter(COMMENT_KEYSET,
+                                                     cursor[1]))
+        except (TypeError, ValueError, ValidationError):
+            pass
+    rows = list(comments[:COMMENTS_PAGE + 1])
+    next_cursor = None
+    if len(rows) > COMMENTS_PAGE:
+        rows = rows[:COMMENTS_PAGE]
+        next_cursor = encode_cursor(
+            'next', [rows[-1].published_at, rows[-1].id], 1)
+    replies = dict(Comment.objects.filter(parent__in=rows, is_published=True)
+                   .order_by().values('parent').annotate(Count('id'))
+                   .values_list('parent', 'id__count'))
+    for comment in rows:
+        comment.replies_count = replies.get(comment.id, 0)
+    return rows, next_cursor
+
+
+def my_reactions(user, comments, news=None):
+    """Проставляет my_reaction (тип реакции пользователя или None)
+    новости и комментариям одним запросом.
+
+    Пары (user, news) и (user, comment) уникальны, поэтому на каждую
+    новость и комментарий приходится не больше одной строки."""
+    targets = {('comment', comment.id): comment for comment in comments}
+    if news is not None:
+        targets['news', news.id] = news
+    for target in targets.values():
+        target.my_reaction = None
+    if not user.is_authenticated or not targets:
+        return
+    condition = Q(comment__in=[comment.id for comment in comments])
+    if news is not None:
+        condition |= Q(news=news.id)
+    for news_id, comment_id, reaction_type in Reaction.objects.filter(
+            condition, user=user).order_by().values_list(
+            'news', 'comment', 'reaction_type'):
+        key = ('news', news_id) if news_id else ('comment', comment_id)
+        if key in targets:
+            targets[key].my_reaction = reaction_type
@@ -0,0 +1,130 @@
+import datetime
+import random
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from films.cache import CATALOG_TAG, invalidate
+from films.helpers import db_value, insert_rows, invalidate_counts
+from news.counters import reconcile
+from news.models import News, NewsBlock, Comment, Reaction
+
+WORDS = ['премьера', 'фильм', 'режиссёр', 'съёмки', 'трейлер', 'сиквел',
+         'фестиваль', 'актёр', 'роль', 'кассовые', 'сборы', 'студия',
+         'новый', 'сериал', 'награда', 'критики', 'зрители', 'финал']
+
+
+class Command(BaseCommand):
+    help = 'Generate deterministic synthetic news, comments and reactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--news', type=int, default=10000)
+        parser.add_argument('--blocks', type=int, default=3,
+                            help='Average number of blocks per news')
+        parser.add_argument('--comments', type=int, default=30,
+                            help='Average number of comments per news')
+        parser.add_argument('--reactions', type=int, default=40,
+                            help='Average number of reactions per news')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='News per transaction')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.now = db_value(Reaction, 'created_at', timezone.now())
+        users = self.create_users(options['users'])
+        self.create_news(options['news'], users)
+        # Строки вставлены напрямую, счётчики считаем одним проходом
+        with transaction.atomic():
+            reconcile()
+        invalidate_counts(News)
+        invalidate(CATALOG_TAG)
+
+    def next_id(self, model):
+        return (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+    def text(self, words):
+        return ' '.join(self.rng.choices(WORDS, k=words)).capitalize()
+
+    def around(self, mean):
+        return self.rng.randint(0, mean * 2)
+
+    def create_users(self, count):
+        User = get_user_model()
+        if not count:
+            users = list(User.objects.values_list('id', flat=True))
+            if not users:
+                raise CommandError('No users to comment and react')
+            return users
+        first_id = self.next_id(User)
+        password = make_password(None)
+        users = [User(id=first_id + i, username=f'user{first_id + i}',
+                      password=password) for i in range(count)]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=5000)
+        print(f'USER {count}')
+        return list(range(first_id, first_id + count))
+
+    def reactions(self, users, mean, news_id=None, comment_id=None):
+        # В Reaction уникальны пары (user, news) и (user, comment)
+        count = min(self.around(mean), len(users))
+        return [(user_id, self.rng.choices([Reaction.LIKE, Reaction.DISLIKE],
+                                           [3, 1])[0],
+                 news_id, comment_id, self.now, self.now)
+                for user_id in self.rng.sample(users, count)]
+
+    def create_news(self, count, users):
+        options = self.options
+        news_id = self.next_id(News)
+        comment_id = self.next_id(Comment)
+        now = timezone.now()
+        for start in range(0, count, options['batch_size']):
+            end = min(start + options['batch_size'], count)
+            news, blocks, comments, reactions = [], [], [], []
+            for _ in range(start, end):
+                published_at = now - datetime.timedelta(
+                    seconds=self.rng.randint(0, 3 * 365 * 24 * 3600))
+                news.append(News(id=news_id, title=self.text(6),
+                                 published_at=published_at,
+                                 is_published=self.rng.random() < 0.95))
+                for order in range(self.around(options['blocks'])):
+                    blocks.append(NewsBlock(news_id=news_id, order=order,
+                                            title=self.text(3),
+                                            content=self.text(80)))
+                reactions += self.reactions(users, options['reactions'],
+                                            news_id=news_id)
+                thread = []
+                for _ in range(self.around(options['comments'])):
+                    # Чаще отвечаем на свежие комментарии, чтобы получались
+                    # длинные ветки
+                    parent_id = None
+                    if thread and self.rng.random() < 0.6:
+                        parent_id = thread[-self.rng.randint(
+                            1, min(len(thread), 3))]
+                    published_at = min(published_at + datetime.timedelta(
+                        seconds=self.rng.randint(1, 3600)), now)
+                    comments.append((
+                        comment_id, news_id, parent_id,
+                        self.rng.choice(users), self.text(20),
+                        db_value(Comment, 'published_at', published_at),
+                        True, self.now, self.now))
+                    reactions += self.reactions(users, 3,
+                                                comment_id=comment_id)
+                    thread.append(comment_id)
+                    comment_id += 1
+                news_id += 1
+            with transaction.atomic():
+                News.objects.bulk_create(news)
+                NewsBlock.objects.bulk_create(blocks)
+                insert_rows(Comment, ('id', 'news', 'parent', 'user',
+                                      'content', 'published_at',
+                                      'is_published', 'created_at',
+                                      'updated_at'), comments)
+                insert_rows(Reaction, ('user', 'reaction_type', 'news',
+                                       'comment', 'created_at', 'updated_at'),
+                            reactions)
+            print(f'NEWS {end}/{count}')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from news.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recount stored reaction and comment counters of news'
+
+    def handle(self, *args, **options):
+        # Счётчики расходятся при правках мимо представлений: в админке,
+        # вставке строк напрямую в таблицы
+        with transaction.atomic():
+            totals = reconcile()
+        for label, fixed in totals.items():
+            print(f'{label} {fixed}')
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0004_remove_newsblock_background_color'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['-published_at', 'id'], name='news_news_publish_8b8134_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:21
+
+from django.db import migrations, models
+from news.counters import reconcile
+
+
+def fill_counters(apps, schema_editor):
+    reconcile(apps.get_model('news', 'News'),
+              apps.get_model('news', 'Comment'),
+              apps.get_model('news', 'Reaction'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0005_news_published_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='dislikes_total',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='likes_total',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='comments_total',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='dislikes_total',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='likes_total',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0006_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['news', 'parent', '-published_at', '-id'], name='news_commen_news_id_710475_idx'),
+        ),
+    ]
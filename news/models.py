@@ -20,22 +20,30 @@ class News(MyModel):
     is_published = models.BooleanField("Опубликовано",
                                        help_text="Отображать новость на сайте",
                                        default=True)
-
+    # Счётчики меняются вместе с реакциями и комментариями (F-выражениями
+    # в представлениях), расхождения чинит команда reconcile_counters
+    likes_total = models.PositiveIntegerField(
+        default=0, db_default=0, editable=False)
+    dislikes_total = models.PositiveIntegerField(
+        default=0, db_default=0, editable=False)
+    comments_total = models.PositiveIntegerField(
+        default=0, db_default=0, editable=False)
 
     @property
     def likes_count(self):
-        return self.reactions.filter(reaction_type=1).count()
+        return self.likes_total
 
     @property
     def dislikes_count(self):
-        return self.reactions.filter(reaction_type=-1).count()
+        return self.dislikes_total
 
     @property
     def comments_count(self):
-        return self.comments.filter(is_published=True).count()
+        return self.comments_total
 
     class Meta:
         ordering = ['-published_at']
+        indexes = [models.Index(fields=['-published_at', 'id'])]
         verbose_name = "Новость"
         verbose_name_plural = "Новости"
 
@@ -78,19 +86,26 @@ class Comment(MyModel):
                                         verbose_name="Дата добавления")
     is_published = models.BooleanField(default=True,
                                        verbose_name="Опубликовано")
+    likes_total = models.PositiveIntegerField(
+        default=0, db_default=0, editable=False)
+    dislikes_total = models.PositiveIntegerField(
+        default=0, db_default=0, editable=False)
 
     @property
     def likes_count(self):
-        return self.reactions.filter(reaction_type=1).count()
+        return self.likes_total
 
     @property
     def dislikes_count(self):
-        return self.reactions.filter(reaction_type=-1).count()
+        return self.dislikes_total
 
     class Meta:
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
         ordering = ['-published_at']
+        # Страницы корневых комментариев новости и ответов на комментарий
+        indexes = [models.Index(
+            fields=['news', 'parent', '-published_at', '-id'])]
 
     def __str__(self):
         return f"Комментарий от {self.user.username}"
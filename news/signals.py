@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from films.helpers import invalidate_counts
+from films.signals import invalidate_on_commit
+from .models import Comment, News, NewsBlock
+
+# Теги страниц для conditional_page: news — список, news:<id> — новость
+# с блоками, комментариями и реакциями. Реакции меняет toggle_reaction
+# мимо сигналов, он сбрасывает тег сам.
+
+
+@receiver(post_save, sender=News)
+@receiver(post_delete, sender=News)
+def news_changed(sender, instance, **kwargs):
+    invalidate_counts(News)
+    invalidate_on_commit('news', f'news:{instance.pk}')
+
+
+@receiver(post_save, sender=NewsBlock)
+@receiver(post_delete, sender=NewsBlock)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def news_part_changed(sender, instance, **kwargs):
+    invalidate_on_commit(f'news:{instance.news_id}')
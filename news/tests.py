@@ -1,3 +1,240 @@
+from django.contrib.auth.models import User
+from unittest.mock import patch
 from django.test import TestCase
+from filmbase.testing import QueryBudgetMixin, get, post
+from .counters import reconcile
+from .models import Comment, News, NewsBlock, Reaction
 
-# Create your tests here.
+
+class NewsTestData:
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='admin')
+        cls.users = [User.objects.create_user(f'user{i}', password='user')
+                     for i in range(5)]
+        cls.news = News.objects.create(title='Новость')
+        for i in range(15):
+            News.objects.create(title=f'Новость {i}')
+        cls.block = NewsBlock.objects.create(news=cls.news, title='Блок',
+                                             content='Текст')
+        cls.comments = []
+        for i, user in enumerate(cls.users * 2):
+            parent = cls.comments[i - 1] if i % 2 else None
+            comment = Comment.objects.create(news=cls.news, user=user,
+                                             parent=parent,
+                                             content=f'Комментарий {i}')
+            cls.comments.append(comment)
+        cls.comment = Comment.objects.create(news=cls.news, user=cls.admin,
+                                             content='Комментарий админа')
+        for user in cls.users:
+            Reaction.objects.create(news=cls.news, user=user,
+                                    reaction_type=Reaction.LIKE)
+            for comment in cls.comments[:4]:
+                Reaction.objects.create(comment=comment, user=user,
+                                        reaction_type=Reaction.DISLIKE)
+        reconcile()
+
+
+class NewsQueryBudgetTest(NewsTestData, QueryBudgetMixin, TestCase):
+    urls_module = 'news.urls'
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def routes(self):
+        news, block = {'id': self.news.id}, {'block_id': self.block.id}
+        comment = {'comment_id': self.comment.id}
+        return {
+            'news:news_list': get(4),
+            # Страница корневых комментариев, число ответов на них и
+            # реакции пользователя
+            'news:news_detail': get(7, **news),
+            'news:news_create': get(2),
+            'news:news_update': get(3, **news),
+            'news:news_delete': get(3, **news),
+            'news:news_block_create': get(3, news_id=self.news.id),
+            'news:news_block_update': get(4, **block),
+            'news:news_block_delete': get(4, **block),
+            # Изменение вместе со счётчиком: SAVEPOINT, UPDATE, RELEASE
+            'news:news_reaction_create': post(8, {'reaction_type': 1},
+                                              **news),
+            'news:comment_list': get(6, **news),
+            'news:comment_create': post(7, {'content': 'Ответ'}, **news),
+            'news:comment_update': post(6, {'content': 'Правка'}, **comment),
+            'news:comment_delete': post(12, **comment),
+            'news:comment_reaction_create': post(8, {'reaction_type': 1},
+                                                 **comment),
+            'news:reaction_toggle': post(9, {'reaction_type': -1},
+                                         target='news', **news),
+        }
+
+
+class NewsConditionalGetTest(NewsTestData, TestCase):
+    def test_reactions_and_comments_change_etag(self):
+        self.client.force_login(self.users[0])
+        url = f'/news/{self.news.id}/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                         .status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/news/reaction/comment/{self.comments[0].id}'
+                             f'/toggle/', {'reaction_type': Reaction.LIKE})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comments[-1].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                         .status_code, 200)
+
+        etag = self.client.get('/news/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            News.objects.create(title='Свежая новость', is_published=True)
+        self.assertEqual(self.client.get('/news/', HTTP_IF_NONE_MATCH=etag)
+                         .status_code, 200)
+
+
+class NewsCountersTest(NewsTestData, TestCase):
+    def assertCounters(self):
+        news = News.objects.get(id=self.news.id)
+        reactions = news.reactions.all()
+        self.assertEqual(
+            (news.likes_count, news.dislikes_count, news.comments_count),
+            (reactions.filter(reaction_type=Reaction.LIKE).count(),
+             reactions.filter(reaction_type=Reaction.DISLIKE).count(),
+             news.comments.filter(is_published=True).count()))
+        for comment in news.comments.all():
+            reactions = comment.reactions.all()
+            self.assertEqual(
+                (comment.likes_count, comment.dislikes_count),
+                (reactions.filter(reaction_type=Reaction.LIKE).count(),
+                 reactions.filter(reaction_type=Reaction.DISLIKE).count()))
+
+    def test_views_keep_counters(self):
+        self.client.force_login(self.users[0])
+        url = f'/news/{self.news.id}/reaction/'
+        comment_url = f'/news/comment/{self.comments[0].id}/reaction/'
+        for reaction_type in [Reaction.DISLIKE, Reaction.DISLIKE,
+                              Reaction.LIKE]:
+            self.client.post(url, {'reaction_type': reaction_type})
+            self.client.post(comment_url, {'reaction_type': reaction_type})
+            self.assertCounters()
+        self.client.post(f'/news/{self.news.id}/comment/create/',
+                         {'content': 'Ещё', 'parent': self.comments[2].id})
+        self.assertEqual(News.objects.get(id=self.news.id).comments_count,
+                         12)
+        # Вместе с комментарием удаляется ответ на него
+        self.client.post(f'/news/comment/{self.comments[0].id}/delete/')
+        self.assertCounters()
+        self.assertEqual(News.objects.get(id=self.news.id).comments_count,
+                         10)
+
+    def test_toggle(self):
+        url = f'/news/reaction/comment/{self.comments[0].id}/toggle/'
+        self.assertEqual(self.client.post(url, {'reaction_type': 1})
+                         .status_code, 403)
+        self.client.force_login(self.users[0])
+        # Дизлайк уже стоит: лайк заменяет его, повторный лайк снимает
+        for reaction, likes, dislikes in [(1, 1, 4), (None, 0, 4),
+                                          (1, 1, 4)]:
+            response = self.client.post(url, {'reaction_type': 1})
+            self.assertEqual(response.json(), {'reaction': reaction,
+                                               'likes': likes,
+                                               'dislikes': dislikes})
+            self.assertCounters()
+        response = self.client.post(f'/news/reaction/news/{self.news.id}/'
+                                    f'toggle/', {'reaction_type': -1})
+        self.assertEqual(response.json(), {'reaction': -1, 'likes': 4,
+                                           'dislikes': 1})
+        self.assertEqual(Reaction.objects.filter(news=self.news).count(), 5)
+        self.assertCounters()
+        for value in ['0', '--1', '²', '+1', ' 1']:
+            self.assertEqual(self.client.post(url, {'reaction_type': value})
+                             .status_code, 400)
+        # Обычная форма с такой реакцией ничего не меняет
+        response = self.client.post(
+            f'/news/{self.news.id}/reaction/', {'reaction_type': '²'})
+        self.assertRedirects(response, f'/news/{self.news.id}/')
+        self.assertCounters()
+        self.assertEqual(self.client.post(
+            f'/news/reaction/block/{self.block.id}/toggle/',
+            {'reaction_type': 1}).status_code, 404)
+
+    def test_reconcile(self):
+        News.objects.update(likes_total=100)
+        Comment.objects.filter(id=self.comments[0].id).update(
+            dislikes_total=0)
+        self.assertEqual(reconcile(), {'news.News': 16, 'news.Comment': 1})
+        self.assertCounters()
+        self.assertEqual(reconcile(), {'news.News': 0, 'news.Comment': 0})
+
+
+class CommentPagesTest(NewsTestData, TestCase):
+    def pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            ids += [comment.id for comment in response.context['comments']]
+            cursor = response.context['next_cursor']
+            url = cursor and response.context['request'].path + \
+                f'?cursor={cursor}'
+        return ids
+
+    @patch('news.helpers.COMMENTS_PAGE', 2)
+    def test_root_pages(self):
+        response = self.client.get(f'/news/{self.news.id}/')
+        self.assertEqual(len(response.context['comments']), 2)
+        self.assertContains(response, 'Показать ещё')
+        roots = Comment.objects.filter(news=self.news, parent=None) \
+            .order_by('-published_at', '-id')
+        ids = [comment.id for comment in response.context['comments']]
+        ids += self.pages(f'/news/{self.news.id}/comments/?cursor='
+                          f'{response.context["next_cursor"]}')
+        self.assertEqual(ids, [comment.id for comment in roots])
+
+    def test_replies(self):
+        first, reply = self.comments[:2]
+        Comment.objects.create(news=self.news, user=self.admin, parent=first,
+                               content='Скрыт', is_published=False)
+        response = self.client.get(f'/news/{self.news.id}/')
+        self.assertContains(response, f'?parent={first.id}')
+        self.assertContains(response, 'Ответы (1)')
+        response = self.client.get(f'/news/{self.news.id}/comments/',
+                                   {'parent': first.id})
+        self.assertEqual(list(response.context['comments']), [reply])
+        self.assertNotContains(response, '<html')
+        # Непонятный parent — страница корневых комментариев
+        response = self.client.get(f'/news/{self.news.id}/comments/',
+                                   {'parent': '²'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['parent'])
+
+    def test_hidden_news(self):
+        News.objects.filter(id=self.news.id).update(is_published=False)
+        response = self.client.get(f'/news/{self.news.id}/comments/')
+        self.assertEqual(response.status_code, 404)
+
+
+class MyReactionsTest(NewsTestData, TestCase):
+    def test_active_reactions(self):
+        user = self.users[0]
+        self.client.force_login(user)
+        response = self.client.get(f'/news/{self.news.id}/')
+        self.assertEqual(response.context['news'].my_reaction, Reaction.LIKE)
+        # Корневые из первых четырёх комментариев: 0 и 2
+        reactions = {comment.id: comment.my_reaction
+                     for comment in response.context['comments']}
+        self.assertEqual(reactions[self.comments[0].id], Reaction.DISLIKE)
+        self.assertEqual(reactions[self.comments[4].id], None)
+        self.assertContains(response, 'reaction-btn active', 3)
+        response = self.client.get(f'/news/{self.news.id}/comments/',
+                                   {'parent': self.comments[0].id})
+        self.assertEqual(response.context['comments'][0].my_reaction,
+                         Reaction.DISLIKE)
+
+    def test_anonymous(self):
+        response = self.client.get(f'/news/{self.news.id}/')
+        self.assertNotContains(response, 'reaction-btn active')
@@ -22,7 +22,9 @@ urlpatterns = [
     path('<int:news_id>/block/create/', views.news_block_create, name='news_block_create'),
     # ТОЛЬКО ПОСЛЕ этого пути для новостей
     path('<int:id>/comment/create/', views.comment_create, name='comment_create'),
+    path('<int:id>/comments/', views.comment_list, name='comment_list'),
     path('<int:id>/reaction/', views.news_reaction_create, name='news_reaction_create'),
+    path('reaction/<str:target>/<int:id>/toggle/', views.reaction_toggle, name='reaction_toggle'),
 
     # САМЫЙ ПОСЛЕДНИЙ - общий путь
     path('<int:id>/', views.news_detail, name='news_detail'),
@@ -1,15 +1,23 @@
 from dal import autocomplete
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import user_passes_test, login_required
-from .models import News, NewsBlock, Comment, Reaction
+from django.db import transaction
+from django.views.decorators.http import require_POST
+from .counters import (REACTION_FIELDS, add_comments, published_in_thread,
+                       toggle_reaction)
+from .models import News, NewsBlock, Comment
 from .forms import NewsForm, NewsBlockForm, CommentForm, ReactionForm
-from .helpers import paginate
+from .helpers import (NUMBER, comment_page, conditional_page, my_reactions,
+                      paginate)
 from django.contrib import messages
 
 
 def check_admin(user):
     return user.is_superuser
 
+
+@conditional_page(lambda: ['news'])
 def news_list(request):
     if request.user.is_superuser:
         news = News.objects.all()
@@ -18,28 +26,59 @@ def news_list(request):
     query = request.GET.get('query', '')
     if query:
         news = news.filter(title__icontains=query)
-    news = news.order_by('-published_at')
-    news = paginate(request, news)
+    news = paginate(request, news, keyset=('-published_at', 'id'))
     return render(request, 'news/list.html', {'news': news,
                                                     'query': query})
 
 
-def news_detail(request, id):
+def news_tags(id):
+    # Блоки, комментарии и реакции сбрасывают тот же тег
+    return [f'news:{id}']
+
+
+def visible_news(request, id):
     if request.user.is_superuser:
-        news = get_object_or_404(News, id=id)
-    else:
-        news = get_object_or_404(News, id=id, is_published=True)
+        return get_object_or_404(News, id=id)
+    return get_object_or_404(News, id=id, is_published=True)
+
+
+@conditional_page(news_tags)
+def news_detail(request, id):
+    news = visible_news(request, id)
     news_blocks = NewsBlock.objects.filter(news=news).order_by('order')
-    comments = Comment.objects.filter(news=news, is_published=True
-    ).order_by('-published_at')
+    # Первая страница корневых комментариев, остальное подгружается
+    # через comment_list
+    comments, next_cursor = comment_page(Comment.objects.filter(
+        news=news, is_published=True, parent=None).select_related('user'))
+    my_reactions(request.user, comments, news)
     comments_form = CommentForm()
     return render(request, 'news/detail.html', {
         'news': news,
         'news_blocks': news_blocks,
         'comments': comments,
+        'next_cursor': next_cursor,
         'comments_form': comments_form
     })
 
+
+@conditional_page(news_tags)
+def comment_list(request, id):
+    """Фрагмент HTML: следующая страница корневых комментариев или
+    ответов на комментарий parent"""
+    news = visible_news(request, id)
+    parent = request.GET.get('parent', '')
+    parent = int(parent) if NUMBER.fullmatch(parent) else None
+    comments, next_cursor = comment_page(
+        Comment.objects.filter(news=news, is_published=True, parent=parent)
+        .select_related('user'), request.GET.get('cursor', ''))
+    my_reactions(request.user, comments)
+    return render(request, 'news/comments.html', {
+        'news': news,
+        'comments': comments,
+        'next_cursor': next_cursor,
+        'parent': parent,
+    })
+
 #
 @user_passes_test(check_admin)
 def news_create(request):
@@ -167,7 +206,9 @@ def comment_create(request, id):
                 # Если родительский комментарий не найден, создаем корневой
                 comment.parent = None
 
-            comment.save()
+            with transaction.atomic():
+                comment.save()
+                add_comments(news.id, 1)
             messages.success(request, 'Комментарий добавлен')
             return redirect('news:news_detail', id=news.id)
         else:
@@ -199,59 +240,66 @@ def comment_delete(request, comment_id):
         messages.error(request, 'Вы не можете удалить этот комментарий')
         return redirect('news:news_detail', id=comment.news.id)
     if request.method == 'POST':
-        comment.delete()
+        # Ответы удаляются каскадом вместе с комментарием
+        with transaction.atomic():
+            add_comments(comment.news_id, -published_in_thread(comment))
+            comment.delete()
         messages.success(request, 'Комментарий удален')
         return redirect('news:news_detail', id=comment.news.id)
     return redirect('news:news_detail', id=comment.news.id)
 
 
-@login_required
-def news_reaction_create(request, id):
-    news = get_object_or_404(News, id=id)
-    reaction_type = int(request.POST.get('reaction_type', 0))
-    existing_reaction = Reaction.objects.filter(
-        news=news,
-        user=request.user).first()
-    if existing_reaction:
-        if existing_reaction.reaction_type == reaction_type:
-            existing_reaction.delete()
+def reaction_target(request, target, id):
+    if target == 'news':
+        return visible_news(request, id)
+    if target == 'comment':
+        return get_object_or_404(Comment, id=id)
+    raise Http404
+
+
+def posted_reaction(request):
+    # Сравниваем строки: int() не разбирает «--1» и «²», хотя isdigit()
+    # их пропускает
+    reactions = {str(reaction_type): reaction_type
+                 for reaction_type in REACTION_FIELDS}
+    return reactions.get(request.POST.get('reaction_type', ''))
+
+
+def react(request, target, id):
+    """Обычная отправка формы реакции: изменение и возврат к новости"""
+    target = reaction_target(request, target, id)
+    news_id = target.id if isinstance(target, News) else target.news_id
+    reaction_type = posted_reaction(request)
+    if request.method == 'POST' and reaction_type is not None:
+        if toggle_reaction(request.user, target, reaction_type) is None:
             messages.info(request, 'Реакция удалена')
         else:
-            existing_reaction.reaction_type = reaction_type
-            existing_reaction.save()
-            messages.success(request, 'Реакция изменена')
-    else:
-        Reaction.objects.create(
-            news=news,
-            user=request.user,
-            reaction_type=reaction_type
-        )
-        messages.success(request, 'Реакция добавлена')
+            messages.success(request, 'Реакция добавлена')
+    return redirect('news:news_detail', id=news_id)
+
+
+@login_required
+def news_reaction_create(request, id):
+    return react(request, 'news', id)
 
-    return redirect('news:news_detail', id=news.id)
 
 @login_required
 def comment_reaction_create(request, comment_id):
-    comment = get_object_or_404(Comment, id=comment_id)
-    news = comment.news
-    reaction_type = int(request.POST.get('reaction_type', 0))
-    existing_reaction = Reaction.objects.filter(
-        comment=comment,
-        user=request.user).first()
-    if existing_reaction:
-        if existing_reaction.reaction_type == reaction_type:
-            existing_reaction.delete()
-            messages.info(request, 'Реакция удалена')
-        else:
-            existing_reaction.reaction_type = reaction_type
-            existing_reaction.save()
-            messages.success(request, 'Реакция изменена')
-    else:
-        Reaction.objects.create(
-            comment=comment,
-            user=request.user,
-            reaction_type=reaction_type
-        )
-        messages.success(request, 'Реакция добавлена')
-
-    return redirect('news:news_detail', id=comment.news.id)
\ No newline at end of file
+    return react(request, 'comment', comment_id)
+
+
+@require_POST
+def reaction_toggle(request, target, id):
+    """JSON для кнопок реакций: реакция пользователя и новые счётчики"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Войдите, чтобы оценивать'},
+                            status=403)
+    target = reaction_target(request, target, id)
+    reaction_type = posted_reaction(request)
+    if reaction_type is None:
+        return JsonResponse({'error': 'Неизвестная реакция'}, status=400)
+    reaction = toggle_reaction(request.user, target, reaction_type)
+    likes, dislikes = type(target).objects.values_list(
+        'likes_total', 'dislikes_total').get(id=target.id)
+    return JsonResponse({'reaction': reaction, 'likes': likes,
+                         'dislikes': dislikes})